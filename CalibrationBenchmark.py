@@ -0,0 +1,324 @@
+import argparse
+import tempfile
+import time
+from collections import defaultdict
+
+import cv2
+import numpy as np
+
+from SingleCalibration import (PATTERN_DETECTORS, ChessboardDetector, Detection, calibration_from_detections,
+                               find_coarse_corners, refine_corners)
+from StereoCalibration import stereo_calibration_from_detections
+from StreamingDetection import decode_image
+
+RESOLUTIONS = {"1080p": (1920, 1080), "4k": (3840, 2160), "12mp": (4000, 3000)}
+PIXELS_PER_SQUARE = 64      # Resolution of the rendered board texture
+BOARD_MARGIN = 1            # White border around the board, in squares
+CIRCLE_RADIUS = 0.3         # Radius of the circles of the circle grids, in squares
+STAGES = ("render", "decode", "detect", "subpix", "solve")
+
+def ground_truth_camera(image_size, right=False):
+    """
+    A plausible camera for the resolution: about 58 degrees horizontal field of view, a slightly
+    off-center principal point and moderate barrel distortion. The right camera differs a little.
+    :param image_size: The image size as (width, height).
+    :param right: Whether to return the right camera of the stereo pair.
+    :return: A tuple (camera_matrix, distortion_coefficients).
+    """
+    width, height = image_size
+    f = width * (0.92 if right else 0.9)
+    offset = -0.006 if right else 0.01
+    camera_matrix = np.array([[f, 0, width * (0.5 + offset)], [0, f * 1.001, height * (0.5 - offset)], [0, 0, 1]])
+    distortion = np.array([-0.11, 0.06, 0.0006, -0.0004, -0.01]) if right else \
+        np.array([-0.13, 0.08, -0.0003, 0.0005, -0.02])
+    return camera_matrix, distortion
+
+# Pose of the right camera relative to the left one: a 10 cm baseline with a slight toe-in
+GROUND_TRUTH_ROTATION = cv2.Rodrigues(np.array([0.01, -0.03, 0.004]))[0]
+GROUND_TRUTH_TRANSLATION = np.array([-0.1, 0.001, 0.002])
+
+def board_texture(detector):
+    """
+    Renders the calibration target with a white margin, PIXELS_PER_SQUARE pixels per square (or per unit of
+    the circle grids). The first point of the target lies one square plus the margin from the top left corner.
+    :param detector: The PatternDetector of the target.
+    :return: The grayscale board image.
+    """
+    objp = detector.object_points(1.0)
+    columns, rows = (np.ptp(objp[:, :2], axis=0) + 2).astype(int)
+    if detector.name == "CHARUCO":
+        board = cv2.aruco.CharucoBoard((columns, rows), 1.0, detector.marker_ratio,
+                                       cv2.aruco.getPredefinedDictionary(getattr(cv2.aruco, detector.dictionary)))
+        texture = board.generateImage((columns * PIXELS_PER_SQUARE, rows * PIXELS_PER_SQUARE), marginSize=0)
+        texture = np.where(texture > 127, 230, 25).astype(np.uint8)
+    elif detector.name in ("CIRCLES_GRID", "ASYMMETRIC_CIRCLES_GRID"):
+        texture = np.full((rows * PIXELS_PER_SQUARE, columns * PIXELS_PER_SQUARE), 230, np.uint8)
+        shift = 4   # Fractional bits of the circle centers
+        for x, y, _ in objp:
+            # Pixel centers are at integer coordinates, so a point k squares in lies at k * PIXELS_PER_SQUARE - 0.5
+            center = (int(round(((x + 1) * PIXELS_PER_SQUARE - 0.5) * 2 ** shift)),
+                      int(round(((y + 1) * PIXELS_PER_SQUARE - 0.5) * 2 ** shift)))
+            cv2.circle(texture, center, int(CIRCLE_RADIUS * PIXELS_PER_SQUARE * 2 ** shift), 25, -1, cv2.LINE_AA,
+                       shift)
+    else:
+        board = np.indices((rows, columns)).sum(axis=0) % 2 == 0
+        texture = np.kron(np.where(board, 25, 230).astype(np.uint8), np.ones((PIXELS_PER_SQUARE,) * 2, np.uint8))
+    margin = BOARD_MARGIN * PIXELS_PER_SQUARE
+    return np.pad(texture, margin, constant_values=230)
+
+def board_outline(objp, square_size):
+    """
+    :param objp: The object points of the target.
+    :return: The four outer corners of the board including its margin, in board coordinates.
+    """
+    lower_x, lower_y = objp[:, :2].min(axis=0) - (1 + BOARD_MARGIN) * square_size
+    upper_x, upper_y = objp[:, :2].max(axis=0) + (1 + BOARD_MARGIN) * square_size
+    return np.array([[lower_x, lower_y, 0], [upper_x, lower_y, 0], [upper_x, upper_y, 0], [lower_x, upper_y, 0]])
+
+def normalized_rays(camera_matrix, distortion, image_size):
+    """
+    The undistorted normalized image coordinates of every pixel of a camera, computed once per camera.
+    :return: A (height, width, 2) float32 array.
+    """
+    width, height = image_size
+    pixels = np.stack(np.meshgrid(np.arange(width, dtype=np.float32), np.arange(height, dtype=np.float32)), axis=-1)
+    criteria = (cv2.TERM_CRITERIA_COUNT + cv2.TERM_CRITERIA_EPS, 20, 1e-6)
+    rays = cv2.undistortPoints(pixels.reshape(-1, 1, 2), camera_matrix, distortion, criteria=criteria)
+    return rays.reshape(height, width, 2)
+
+def render_view(rays, texture, rvec, tvec, square_size, noise, rng, occlusion=None):
+    """
+    Renders the board seen from a pose: every pixel's ray is intersected with the board plane and
+    the board texture is sampled there.
+    :param rays: The normalized_rays of the camera.
+    :param texture: The board_texture.
+    :param rvec: The rotation vector of the board in camera coordinates.
+    :param tvec: The translation vector of the board in camera coordinates.
+    :param square_size: The size of one chessboard square.
+    :param noise: The standard deviation of the added sensor noise in gray levels.
+    :param rng: The random generator for the noise.
+    :param occlusion: A polygon of image points painted over the board, or None.
+    :return: The grayscale image.
+    """
+    rotation = cv2.Rodrigues(rvec)[0]
+    # Homography from the board plane to normalized image coordinates, and its inverse
+    plane_to_image = np.column_stack([rotation[:, 0], rotation[:, 1], np.ravel(tvec)])
+    image_to_texture = np.array([[PIXELS_PER_SQUARE / square_size, 0, (1 + BOARD_MARGIN) * PIXELS_PER_SQUARE - 0.5],
+                                 [0, PIXELS_PER_SQUARE / square_size, (1 + BOARD_MARGIN) * PIXELS_PER_SQUARE - 0.5],
+                                 [0, 0, 1]]) @ np.linalg.inv(plane_to_image)
+    maps = cv2.perspectiveTransform(rays, image_to_texture)
+    image = cv2.remap(texture, maps, None, cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT, borderValue=230)
+    if occlusion is not None:
+        cv2.fillPoly(image, [np.round(occlusion).astype(np.int32)], 128)
+    image = cv2.GaussianBlur(image, (0, 0), 0.6)
+    if noise:
+        image = np.clip(image + rng.normal(0, noise, image.shape), 0, 255).astype(np.uint8)
+    return image
+
+def random_poses(count, cameras, square_size, objp, image_size, rng):
+    """
+    Draws board poses in which the whole board is visible in every camera, tilted up to 35 degrees.
+    :param count: The number of poses.
+    :param cameras: (camera_matrix, distortion, rotation, translation) of each camera relative to the first.
+    :param objp: The object points of the target.
+    :return: A list of (rvec, tvec) of the board in the first camera's coordinates.
+    """
+    outline = board_outline(objp, square_size)
+    center = outline.mean(axis=0)
+    board_size = np.ptp(outline, axis=0).max()
+    width, height = image_size
+    poses = []
+    while len(poses) < count:
+        angles = rng.uniform([-0.6, -0.6, -0.25], [0.6, 0.6, 0.25])
+        rotation = cv2.Rodrigues(angles)[0]
+        fov = width / cameras[0][0][0, 0]
+        distance = rng.uniform(1.1, 2.6) * board_size / fov
+        # Place the board center on a random ray, then move the board origin accordingly
+        ray = np.array([rng.uniform(-0.35, 0.35) * fov, rng.uniform(-0.35, 0.35) * fov * height / width, 1])
+        tvec = ray * distance - rotation @ center
+        visible = True
+        for camera_matrix, distortion, rig_rotation, rig_translation in cameras:
+            points = (outline @ rotation.T + tvec) @ rig_rotation.T + rig_translation
+            if np.any(points[:, 2] <= 0):
+                visible = False
+                break
+            projected = cv2.projectPoints(points, np.zeros(3), np.zeros(3), camera_matrix, distortion)[0].reshape(-1, 2)
+            if np.any(projected < 10) or np.any(projected > [width - 11, height - 11]):
+                visible = False
+                break
+        if visible:
+            poses.append((angles, tvec))
+    return poses
+
+def corner_errors(detection, truth):
+    """
+    :return: The RMS distance in pixels between detected and true corners, allowing for the reversed
+             corner order a symmetric board can be detected in.
+    """
+    detected = detection.corners.reshape(-1, 2)
+    forward = np.sqrt(np.mean(np.sum((detected - truth) ** 2, axis=1)))
+    backward = np.sqrt(np.mean(np.sum((detected[::-1] - truth) ** 2, axis=1)))
+    return min(forward, backward)
+
+def occluder(objp, rvec, tvec, camera_matrix, distortion, rng):
+    """
+    :return: A polygon covering a random corner region of about a quarter of the board in the image.
+    """
+    lower, upper = objp[:, :2].min(axis=0), objp[:, :2].max(axis=0)
+    corner = np.where(rng.random(2) < 0.5, lower, upper)
+    inner = corner + (lower + upper - 2 * corner) * rng.uniform(0.35, 0.6, 2)
+    outer = corner - (inner - corner)
+    quad = np.array([[outer[0], outer[1], 0], [inner[0], outer[1], 0], [inner[0], inner[1], 0],
+                     [outer[0], inner[1], 0]])
+    return cv2.projectPoints(quad, rvec, tvec, camera_matrix, distortion)[0].reshape(-1, 2)
+
+def process_views(rays, texture, camera_matrix, distortion, poses, args, timings, rng):
+    """
+    Runs every view of one camera through the pipeline stages, timing each stage.
+    The chessboard search is timed as detect and subpix; the other targets are detected in one step.
+    :return: The Detection and the corner error of each view.
+    """
+    objp = args.detector.object_points(args.square_size).astype(np.float64)
+    chessboard = isinstance(args.detector, ChessboardDetector)
+    detections, errors = [], []
+    for rvec, tvec in poses:
+        start = time.perf_counter()
+        occlusion = None
+        if rng.random() < args.occlude:
+            occlusion = occluder(objp, rvec, tvec, camera_matrix, distortion, rng)
+        image = render_view(rays, texture, rvec, tvec, args.square_size, args.noise, rng, occlusion)
+        payload = cv2.imencode(".png", image, [cv2.IMWRITE_PNG_COMPRESSION, 1])[1].tobytes()
+        timings["render"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        gray = decode_image(payload)
+        timings["decode"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        if chessboard:
+            found, corners = find_coarse_corners(gray, args.detector.pattern_size, args.scale)
+            ids = None
+        else:
+            corners, ids = args.detector.detect(gray, args.scale)
+            found = corners is not None
+        timings["detect"] += time.perf_counter() - start
+        if not found:
+            detections.append(Detection(False, None, gray.shape[::-1]))
+            continue
+
+        if chessboard:
+            start = time.perf_counter()
+            corners = refine_corners(gray, corners)
+            timings["subpix"] += time.perf_counter() - start
+        detection = Detection(True, corners, gray.shape[::-1], ids)
+        detections.append(detection)
+        points = objp if ids is None else objp[ids]
+        truth = cv2.projectPoints(points, rvec, tvec, camera_matrix, distortion)[0].reshape(-1, 2)
+        errors.append(corner_errors(detection, truth))
+    return detections, errors
+
+def rotation_error(estimated, truth):
+    """
+    :return: The angle in degrees of the rotation between two rotation matrices.
+    """
+    return np.degrees(np.linalg.norm(cv2.Rodrigues(estimated @ truth.T)[0]))
+
+def intrinsics_report(name, calibration_file, camera_matrix, distortion):
+    """
+    Compares a saved camera calibration with the ground truth.
+    """
+    data = np.load(calibration_file)
+    estimated = data['camera_matrix']
+    print(f"{name}: RMS {float(data['rms_error']):.4f} px, "
+          f"fx {estimated[0, 0] - camera_matrix[0, 0]:+.3f}, fy {estimated[1, 1] - camera_matrix[1, 1]:+.3f}, "
+          f"cx {estimated[0, 2] - camera_matrix[0, 2]:+.3f}, cy {estimated[1, 2] - camera_matrix[1, 2]:+.3f} px, "
+          f"distortion {np.abs(data['distortion_coefficients'].ravel()[:5] - distortion).max():.5f} max abs error")
+
+def main():
+    """
+    Benchmarks the calibration pipeline on rendered views of a calibration target with a known ground truth.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark calibration speed and accuracy on synthetic views.")
+    parser.add_argument("--mode", choices=("SINGLE", "STEREO"), default="STEREO", help="Calibration mode.")
+    parser.add_argument("--resolution", default="1080p",
+                        help=f"One of {', '.join(RESOLUTIONS)} or WIDTHxHEIGHT.")
+    parser.add_argument("--views", type=int, default=20, help="Number of views (stereo pairs in STEREO mode).")
+    parser.add_argument("--pattern", choices=PATTERN_DETECTORS, default="CHESSBOARD", help="Calibration target.")
+    parser.add_argument("--size", help="Points of the target as WIDTHxHEIGHT, 7x10 by default (4x11 for the "
+                                       "asymmetric circle grid).")
+    parser.add_argument("--occlude", type=float, default=0.0,
+                        help="Fraction of the views in which a corner region of the board is covered.")
+    parser.add_argument("--scale", type=float, default=1.0, help="Downscale factor for the coarse corner search.")
+    parser.add_argument("--noise", type=float, default=2.0, help="Sensor noise in gray levels.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the poses and noise.")
+    args = parser.parse_args()
+    args.square_size = 0.035
+    if args.size:
+        pattern_size = tuple(int(v) for v in args.size.split("x"))
+    else:
+        pattern_size = (4, 11) if args.pattern == "ASYMMETRIC_CIRCLES_GRID" else (7, 10)
+    args.detector = PATTERN_DETECTORS[args.pattern](pattern_size)
+    image_size = RESOLUTIONS.get(args.resolution.lower()) or tuple(int(v) for v in args.resolution.split("x"))
+
+    rng = np.random.default_rng(args.seed)
+    texture = board_texture(args.detector)
+    cameras = [ground_truth_camera(image_size)]
+    if args.mode == "STEREO":
+        cameras.append(ground_truth_camera(image_size, right=True))
+    rig = [(np.eye(3), np.zeros(3)), (GROUND_TRUTH_ROTATION, GROUND_TRUTH_TRANSLATION)]
+    poses = random_poses(args.views, [camera + rig[i] for i, camera in enumerate(cameras)],
+                         args.square_size, args.detector.object_points(args.square_size), image_size, rng)
+
+    timings = defaultdict(float)
+    detections, errors = [], []
+    for (camera_matrix, distortion), (rig_rotation, rig_translation) in zip(cameras, rig):
+        start = time.perf_counter()
+        rays = normalized_rays(camera_matrix, distortion, image_size)
+        timings["render"] += time.perf_counter() - start
+        # Board poses in this camera's coordinates
+        camera_poses = [(cv2.Rodrigues(rig_rotation @ cv2.Rodrigues(rvec)[0])[0].ravel(),
+                         rig_rotation @ tvec + rig_translation) for rvec, tvec in poses]
+        camera_detections, camera_errors = process_views(rays, texture, camera_matrix, distortion, camera_poses,
+                                                         args, timings, rng)
+        detections.append(camera_detections)
+        errors += camera_errors
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        start = time.perf_counter()
+        if args.mode == "STEREO":
+            rms = stereo_calibration_from_detections(detections[0], detections[1], args.square_size,
+                                                     args.detector, output_dir)
+        else:
+            rms = calibration_from_detections(detections[0], args.square_size, args.detector, "SINGLE",
+                                              output_dir).rms_error
+        timings["solve"] += time.perf_counter() - start
+
+        images = sum(len(camera_detections) for camera_detections in detections)
+        found = sum(detection.found for camera_detections in detections for detection in camera_detections)
+        print(f"{args.mode} calibration, {args.pattern}, {image_size[0]}x{image_size[1]}, {args.views} views, "
+              f"{found}/{images} boards found")
+        print(f"Corner error: {np.sqrt(np.mean(np.square(errors))):.4f} px RMS, "
+              f"{np.max(errors):.4f} px worst view")
+        print("Stage timings (render is setup, not part of the pipeline):")
+        for stage in STAGES:
+            per_image = "" if stage == "solve" else f", {timings[stage] / images * 1000:.1f} ms/image"
+            print(f"  {stage:<7} {timings[stage]:8.3f} s{per_image}")
+        pipeline = sum(timings[stage] for stage in STAGES if stage != "render")
+        print(f"  total   {pipeline:8.3f} s")
+
+        print("Accuracy against the ground truth:")
+        if args.mode == "STEREO":
+            intrinsics_report("Left", f"{output_dir}/left_calibration_data.npz", *cameras[0])
+            intrinsics_report("Right", f"{output_dir}/right_calibration_data.npz", *cameras[1])
+            data = np.load(f"{output_dir}/stereo_calibration_data.npz")
+            translation = data['translation_vector'].ravel()
+            rotation = rotation_error(data['rotation_matrix'], GROUND_TRUTH_ROTATION)
+            baseline = np.linalg.norm(translation) - np.linalg.norm(GROUND_TRUTH_TRANSLATION)
+            offset = np.linalg.norm(translation - GROUND_TRUTH_TRANSLATION)
+            print(f"Stereo: RMS {rms:.4f} px, rotation {rotation:.4f} deg, baseline {baseline * 1000:+.3f} mm, "
+                  f"translation {offset * 1000:.3f} mm")
+        else:
+            intrinsics_report("Camera", f"{output_dir}/single_calibration_data.npz", *cameras[0])
+
+if __name__ == "__main__":
+    main()
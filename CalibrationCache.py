@@ -0,0 +1,140 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from SingleCalibration import pattern_detector
+
+# Fingerprint standing in for a frame dropped before its detection; no received frame hashes to it
+DROPPED_FRAME = bytes(16)
+
+def frame_fingerprint(image_data, payload_format="PNG", size=None):
+    """
+    Content hash of a received image, so that a frame sent again is recognized without detecting it again.
+    :param image_data: The image payload as received.
+    :param payload_format: The payload format, one of PAYLOAD_FORMATS.
+    :param size: The frame size as (width, height) for the GRAY8 formats.
+    :return: The fingerprint as bytes.
+    """
+    digest = hashlib.blake2b(f"{payload_format}:{size}:".encode(), digest_size=16)
+    digest.update(image_data)
+    return digest.digest()
+
+def detection_key(fingerprint, pattern, scale):
+    """
+    :param fingerprint: The frame_fingerprint of the image.
+    :param pattern: The PatternDetector, or the number of inner corners (width, height) of a chessboard.
+    :param scale: The downscale factor for the coarse corner search.
+    :return: The key of the image's Detection; it covers every parameter the detected corners depend on.
+    """
+    return fingerprint, pattern_detector(pattern).key(), scale
+
+def result_key(fingerprints, mode, square_size, pattern, scale, max_view_error=None):
+    """
+    :param fingerprints: The frame fingerprints of every camera side, each in view order.
+    :param mode: The calibration mode (SINGLE or STEREO).
+    :param square_size: The size of the target's unit, e.g. one chessboard square.
+    :param pattern: The PatternDetector, or the number of inner corners (width, height) of a chessboard.
+    :param scale: The downscale factor for the coarse corner search.
+    :param max_view_error: The outlier view threshold of the calibration.
+    :return: The key of the calibration result of this ordered frame set.
+    """
+    parameters = f"{mode}:{square_size}:{pattern_detector(pattern).key()}:{scale}:{max_view_error}:"
+    digest = hashlib.blake2b(parameters.encode(), digest_size=16)
+    for side in fingerprints:
+        digest.update(len(side).to_bytes(4, "little"))
+        for fingerprint in side:
+            digest.update(fingerprint)
+    return digest.digest()
+
+class LRUCache:
+    """
+    Thread-safe mapping holding at most max_entries items, evicting the least recently used one first.
+    """
+
+    def __init__(self, max_entries):
+        """
+        :param max_entries: The maximum number of cached items; 0 disables the cache.
+        """
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        :param key: The key to look up.
+        :return: The cached value, or None if the key is not cached.
+        """
+        with self._lock:
+            value = self._items.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """
+        Caches a value, evicting the least recently used items beyond max_entries.
+        :param key: The key to cache the value under.
+        :param value: The value, must not be None.
+        """
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._items)
+
+class CalibrationCache:
+    """
+    Content-addressed cache shared by all sessions: the Detection of every frame by its fingerprint
+    and the detection parameters, and the saved calibration results by the fingerprint of the ordered
+    frame set. A client that reconnects and sends frames again skips their detection, and an identical
+    frame set skips the solve as well.
+    """
+
+    def __init__(self, max_detections, max_results):
+        """
+        :param max_detections: The maximum number of cached frame detections.
+        :param max_results: The maximum number of cached calibration results.
+        """
+        self.detections = LRUCache(max_detections)
+        self.results = LRUCache(max_results)
+
+    def detection(self, key):
+        """
+        :param key: The detection_key of a frame.
+        :return: The cached Detection, or None.
+        """
+        return self.detections.get(key)
+
+    def store_detection(self, key, future):
+        """
+        Caches the Detection of a frame once its background detection finished successfully.
+        :param key: The detection_key of the frame.
+        :param future: The future of the frame's Detection.
+        """
+        def done(future):
+            if not future.cancelled() and future.exception() is None:
+                self.detections.put(key, future.result())
+        future.add_done_callback(done)
+
+    def result(self, key):
+        """
+        :param key: The result_key of a frame set.
+        :return: The cached result files as {filename: bytes}, or None.
+        """
+        return self.results.get(key)
+
+    def store_result(self, key, files):
+        """
+        :param key: The result_key of the frame set.
+        :param files: The saved result files as {filename: bytes}.
+        """
+        self.results.put(key, files)
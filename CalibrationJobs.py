@@ -0,0 +1,105 @@
+import functools
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, wait
+
+import cv2
+import numpy as np
+
+from Instrumentation import configure_logging
+from RectificationMaps import rectification_from_calibration
+from SingleCalibration import camera_calibration
+from StereoCalibration import stereo_calibration_from_detections
+
+def _init_worker(log_level=None):
+    """
+    Prepares a calibration worker process. Importing this module in the worker already loaded cv2.
+    :param log_level: The minimum level of the worker's log records, None to leave logging unconfigured.
+    """
+    cv2.setNumThreads(1)
+    if log_level is not None:
+        configure_logging(log_level)
+
+def _warm_up():
+    """
+    Runs a tiny OpenCV call so the first real job does not pay for any lazy initialization.
+    :return: The id of the worker process.
+    """
+    cv2.cvtColor(np.zeros((8, 8, 3), np.uint8), cv2.COLOR_BGR2GRAY)
+    return os.getpid()
+
+def run_single_calibration(detections, square_size, pattern, prefix, output_dir, max_view_error):
+    """
+    Calibration job for a single camera.
+    :return: A CameraCalibration.
+    """
+    return camera_calibration(None, square_size, pattern, prefix, detections, output_dir=output_dir,
+                              max_view_error=max_view_error)
+
+def run_stereo_calibration(left_detections, right_detections, square_size, pattern, output_dir,
+                           max_view_error):
+    """
+    Calibration job for a stereo pair.
+    :return: The stereo RMS re-projection error.
+    """
+    return stereo_calibration_from_detections(left_detections, right_detections, square_size, pattern,
+                                              output_dir, max_view_error)
+
+def run_rectification(directory):
+    """
+    Rectification job for a stereo calibration saved in directory, whose maps are missing.
+    """
+    rectification_from_calibration(os.path.join(directory, 'stereo_calibration_data.npz'), directory)
+
+class CalibrationJobRunner:
+    """
+    Pool of warm worker processes, with cv2 already imported, that run calibration solves.
+    Jobs are submitted in-process and their results come back as futures to the caller.
+    """
+
+    def __init__(self, workers=None, log_level=None):
+        """
+        :param workers: The number of worker processes, defaults to one per core.
+        :param log_level: The minimum level of the workers' log records, None to leave their logging unconfigured.
+        """
+        self.workers = workers or os.cpu_count()
+        # Spawned workers do not inherit the server's threads or sockets, nor its logging configuration
+        self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=multiprocessing.get_context("spawn"),
+                                             initializer=functools.partial(_init_worker, log_level))
+
+    def warm_up(self):
+        """
+        Starts the worker processes ahead of the first job and waits until they are ready.
+        """
+        wait([self._executor.submit(_warm_up) for _ in range(self.workers)])
+
+    def submit_single(self, detections, square_size, pattern, prefix, output_dir=".", max_view_error=None):
+        """
+        Queues a single camera calibration.
+        :return: A future resolving to a CameraCalibration.
+        """
+        return self._executor.submit(run_single_calibration, detections, square_size, pattern, prefix,
+                                     output_dir, max_view_error)
+
+    def submit_stereo(self, left_detections, right_detections, square_size, pattern, output_dir=".",
+                      max_view_error=None):
+        """
+        Queues a stereo calibration.
+        :return: A future resolving to the stereo RMS re-projection error.
+        """
+        return self._executor.submit(run_stereo_calibration, left_detections, right_detections, square_size,
+                                     pattern, output_dir, max_view_error)
+
+    def submit_rectification(self, directory):
+        """
+        Queues the computation of the rectification maps of a saved stereo calibration.
+        :return: A future resolving once the maps are saved.
+        """
+        return self._executor.submit(run_rectification, directory)
+
+    def shutdown(self):
+        """
+        Stops the worker processes.
+        """
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,214 @@
+import argparse
+import io
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import namedtuple
+from datetime import datetime
+
+import numpy as np
+
+# One saved calibration file of a rig: camera is LEFT, RIGHT, SINGLE or STEREO, created the Unix time of the
+# calibration and data the NPZ file as bytes
+CalibrationRecord = namedtuple("CalibrationRecord", ["id", "rig", "camera", "created", "rms_error", "data"])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS calibrations (
+    id INTEGER PRIMARY KEY,
+    rig TEXT NOT NULL,
+    camera TEXT NOT NULL,
+    created REAL NOT NULL,
+    rms_error REAL NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS calibrations_by_time ON calibrations (rig, camera, created);
+CREATE TABLE IF NOT EXISTS latest (
+    rig TEXT NOT NULL,
+    camera TEXT NOT NULL,
+    id INTEGER NOT NULL REFERENCES calibrations (id),
+    PRIMARY KEY (rig, camera)
+) WITHOUT ROWID;
+"""
+
+COMPRESSION_LEVEL = 6   # zlib level of the stored NPZ files; they shrink to about a third
+
+def camera_name(filename):
+    """
+    :param filename: The name of a saved calibration file, e.g. left_calibration_data.npz.
+    :return: The camera the file belongs to, e.g. LEFT.
+    """
+    return filename[:-len("_calibration_data.npz")].upper()
+
+def load_record(record):
+    """
+    :param record: A CalibrationRecord.
+    :return: The arrays of the record's NPZ file as {name: array}.
+    """
+    with np.load(io.BytesIO(record.data)) as data:
+        return dict(data)
+
+class CalibrationStore:
+    """
+    Versioned store of the calibration results of every rig in one SQLite file. Every calibration adds
+    a record per saved file (one per camera and, for stereo rigs, the stereo result) in one transaction,
+    so readers never see half a calibration, and earlier calibrations stay available for drift analysis.
+    The latest record of every rig and camera is kept in an index table and, once read, in memory; a store
+    does not see the calibrations other processes add to the same file after it read the latest one.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: The SQLite file, created with its directory if it does not exist.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(SCHEMA)
+        self._latest = {}
+        self._lock = threading.Lock()
+
+    def save(self, rig, files, created=None):
+        """
+        Adds a calibration of a rig, atomically, and makes it the rig's latest one.
+        :param rig: The rig ID.
+        :param files: The saved calibration files as {filename: bytes}, see camera_name.
+        :param created: The Unix time of the calibration, now by default.
+        :return: The new CalibrationRecord of every file.
+        """
+        created = time.time() if created is None else created
+        rows = []
+        for filename, data in sorted(files.items()):
+            with np.load(io.BytesIO(data)) as arrays:
+                rms_error = float(arrays["rms_error"])
+            rows.append((rig, camera_name(filename), created, rms_error, data))
+        records = []
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                for rig, camera, created, rms_error, data in rows:
+                    cursor = self._connection.execute(
+                        "INSERT INTO calibrations (rig, camera, created, rms_error, data) VALUES (?, ?, ?, ?, ?)",
+                        (rig, camera, created, rms_error, zlib.compress(data, COMPRESSION_LEVEL)))
+                    self._connection.execute("INSERT OR REPLACE INTO latest (rig, camera, id) VALUES (?, ?, ?)",
+                                             (rig, camera, cursor.lastrowid))
+                    records.append(CalibrationRecord(cursor.lastrowid, rig, camera, created, rms_error, data))
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            for record in records:
+                self._latest[(rig, record.camera)] = record
+        return records
+
+    def latest(self, rig, camera="STEREO"):
+        """
+        :param rig: The rig ID.
+        :param camera: The camera (LEFT, RIGHT or SINGLE) or STEREO for the stereo result.
+        :return: The CalibrationRecord saved last for the rig and camera, or None.
+        """
+        record = self._latest.get((rig, camera))
+        if record is not None:
+            return record
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT calibrations.id, calibrations.rig, calibrations.camera, created, rms_error, data "
+                "FROM latest JOIN calibrations ON calibrations.id = latest.id "
+                "WHERE latest.rig = ? AND latest.camera = ?", (rig, camera)).fetchone()
+            if row is None:
+                return None
+            record = self._record(row)
+            # A newer calibration saved meanwhile by this store takes precedence
+            return self._latest.setdefault((rig, camera), record)
+
+    def history(self, rig, camera="STEREO", start=None, end=None):
+        """
+        :param rig: The rig ID.
+        :param camera: The camera (LEFT, RIGHT or SINGLE) or STEREO for the stereo result.
+        :param start: The earliest Unix time to include, None for no limit.
+        :param end: The Unix time to stop before, None for no limit.
+        :return: The CalibrationRecords of the rig and camera in the time range, oldest first.
+        """
+        start = float("-inf") if start is None else start
+        end = float("inf") if end is None else end
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT id, rig, camera, created, rms_error, data FROM calibrations "
+                "WHERE rig = ? AND camera = ? AND created >= ? AND created < ? ORDER BY created, id",
+                (rig, camera, start, end)).fetchall()
+        return [self._record(row) for row in rows]
+
+    def rigs(self):
+        """
+        :return: The IDs of all rigs with a calibration, sorted.
+        """
+        with self._lock:
+            return [rig for rig, in self._connection.execute("SELECT DISTINCT rig FROM latest ORDER BY rig")]
+
+    def close(self):
+        """
+        Closes the SQLite connection.
+        """
+        with self._lock:
+            self._connection.close()
+
+    @staticmethod
+    def _record(row):
+        record_id, rig, camera, created, rms_error, data = row
+        return CalibrationRecord(record_id, rig, camera, created, rms_error, zlib.decompress(data))
+
+def _parse_time(value):
+    """
+    :param value: An ISO 8601 date or time, e.g. 2024-05-01 or 2024-05-01T12:00.
+    :return: The Unix time.
+    """
+    return datetime.fromisoformat(value).timestamp()
+
+def print_history(store, rig, camera, start=None, end=None):
+    """
+    Prints one line per calibration of a rig's camera in a time range, with its intrinsics or, for the
+    stereo result, its baseline, to follow their drift.
+    """
+    for record in store.history(rig, camera, start, end):
+        arrays = load_record(record)
+        created = datetime.fromtimestamp(record.created).isoformat(sep=" ", timespec="seconds")
+        if camera == "STEREO":
+            translation = arrays["translation_vector"].ravel()
+            details = f"baseline {np.linalg.norm(translation):.6f}, translation {np.round(translation, 6).tolist()}"
+        else:
+            matrix = arrays["camera_matrix"]
+            details = (f"fx {matrix[0, 0]:.3f}, fy {matrix[1, 1]:.3f}, cx {matrix[0, 2]:.3f}, "
+                       f"cy {matrix[1, 2]:.3f}")
+        print(f"{created}  #{record.id}  RMS {record.rms_error:.4f} px  {details}")
+
+def main():
+    """
+    Lists the rigs of a calibration store, or the calibration history of one rig.
+    """
+    parser = argparse.ArgumentParser(description="Query the versioned calibration store of the server.")
+    parser.add_argument("store", help="The SQLite file of the store, e.g. sessions/calibrations.sqlite3.")
+    parser.add_argument("rig", nargs="?", help="The rig whose history to print; all rigs are listed without it.")
+    parser.add_argument("--camera", default="STEREO", help="LEFT, RIGHT, SINGLE or STEREO (the default).")
+    parser.add_argument("--since", type=_parse_time, help="Earliest calibration time, ISO 8601.")
+    parser.add_argument("--until", type=_parse_time, help="Calibration time to stop before, ISO 8601.")
+    args = parser.parse_args()
+    if not os.path.exists(args.store):
+        parser.error(f"no calibration store at {args.store}")
+
+    store = CalibrationStore(args.store)
+    try:
+        if args.rig is None:
+            for rig in store.rigs():
+                print(rig)
+        else:
+            print_history(store, args.rig, args.camera.upper(), args.since, args.until)
+    finally:
+        store.close()
+
+if __name__ == "__main__":
+    main()
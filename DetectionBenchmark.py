@@ -0,0 +1,64 @@
+import argparse
+import os
+import time
+
+import numpy as np
+
+from SingleCalibration import detect_images, find_image_files
+
+def time_detection(images, pattern_size, workers, repeats, scale=1.0):
+    """
+    Times the chessboard detection of an image set.
+    :param images: The list of image paths.
+    :param pattern_size: The chessboard pattern (width, height).
+    :param workers: The number of detection processes.
+    :param repeats: How many times to run the detection.
+    :param scale: The downscale factor for the coarse corner search.
+    :return: The best wall time in seconds and the detections of the last run.
+    """
+    best = float("inf")
+    detections = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        detections = detect_images(images, pattern_size, workers, scale)
+        best = min(best, time.perf_counter() - start)
+    return best, detections
+
+def same_detections(first, second):
+    """
+    Checks that two detection runs produced bit-identical results.
+    """
+    if len(first) != len(second):
+        return False
+    for a, b in zip(first, second):
+        if a.found != b.found or a.image_size != b.image_size:
+            return False
+        if a.found and not np.array_equal(a.corners, b.corners):
+            return False
+    return True
+
+def main():
+    """
+    Compares serial and process-pool detection wall time on the bundled LEFT/RIGHT sets.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark serial vs. parallel chessboard detection.")
+    parser.add_argument("--images", type=int, default=20, help="Number of images per camera.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of detection processes.")
+    parser.add_argument("--scale", type=float, default=1.0, help="Downscale factor for the coarse corner search.")
+    parser.add_argument("--repeats", type=int, default=3, help="Runs per mode; the best time is reported.")
+    args = parser.parse_args()
+
+    pattern_size = (7, 10)
+    images = find_image_files("LEFT", "LEFT", args.images) + find_image_files("RIGHT", "RIGHT", args.images)
+
+    serial_time, serial = time_detection(images, pattern_size, 1, args.repeats, args.scale)
+    parallel_time, parallel = time_detection(images, pattern_size, args.workers, args.repeats, args.scale)
+
+    print(f"Images: {len(images)}, boards found: {sum(d.found for d in serial)}")
+    print(f"Serial:   {serial_time:.3f} s ({len(images) / serial_time:.1f} images/s)")
+    print(f"Parallel: {parallel_time:.3f} s ({len(images) / parallel_time:.1f} images/s) with {args.workers} workers")
+    print(f"Speedup:  {serial_time / parallel_time:.2f}x")
+    print(f"Identical results: {same_detections(serial, parallel)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import cv2
+import numpy as np
+
+POSITION_BINS = 3               # Bins per image axis for the board center
+SCALE_EDGES = (0.25, 0.45)      # Edges between the small/medium/large board size bins (fraction of the image diagonal)
+TILT_EDGES = (0.92, 1.08)       # Edges between the tilt bins (ratio of opposite board edge lengths)
+
+def outer_corners(points, pattern_size, ids=None):
+    """
+    :param points: The detected corners, (N, 2), in row-major board order or in the order of ids.
+    :param pattern_size: The number of corners of the board (width, height).
+    :param ids: The row-major board index of each detected corner for partial detections, None for all corners.
+    :return: The image positions of the top-left, top-right, bottom-left and bottom-right board corners, (4, 2).
+             For partial detections they are extrapolated with the homography of the detected corners.
+    """
+    width, height = pattern_size
+    if ids is None:
+        return points[[0, width - 1, -width, -1]]
+    grid = np.stack([ids % width, ids // width], axis=1).astype(np.float64)
+    homography, _ = cv2.findHomography(grid, points)
+    outer = np.array([[0, 0], [width - 1, 0], [0, height - 1], [width - 1, height - 1]], np.float64)
+    return cv2.perspectiveTransform(outer.reshape(-1, 1, 2), homography).reshape(-1, 2)
+
+def view_bin(corners, image_size, pattern_size, ids=None):
+    """
+    Classifies a board view by the position of its center, its apparent size and its tilt.
+    :param corners: The detected corners, (N, 1, 2) or (N, 2), in row-major board order or in the order of ids.
+    :param image_size: The image size as (width, height).
+    :param pattern_size: The number of corners of the board (width, height).
+    :param ids: The board index of each detected corner for partial detections, None for all corners.
+    :return: A hashable bin key (column, row, scale, horizontal tilt, vertical tilt).
+    """
+    points = np.asarray(corners, np.float64).reshape(-1, 2)
+    size = np.asarray(image_size, np.float64)
+
+    column, row = np.minimum((points.mean(axis=0) / size * POSITION_BINS).astype(int), POSITION_BINS - 1)
+
+    extent = np.ptp(points, axis=0)
+    scale = int(np.searchsorted(SCALE_EDGES, np.hypot(*extent) / np.hypot(*size)))
+
+    outer = outer_corners(points, pattern_size, ids)
+    top, bottom = np.linalg.norm(outer[1] - outer[0]), np.linalg.norm(outer[3] - outer[2])
+    left, right = np.linalg.norm(outer[2] - outer[0]), np.linalg.norm(outer[3] - outer[1])
+    tilt_x = int(np.searchsorted(TILT_EDGES, left / right))
+    tilt_y = int(np.searchsorted(TILT_EDGES, top / bottom))
+
+    return int(column), int(row), scale, tilt_x, tilt_y
+
+class CoverageMap:
+    """
+    Counts the accepted views per bin of board position, size and tilt, so that views which
+    would not add information to the calibration can be rejected.
+    """
+
+    def __init__(self, pattern_size, max_views_per_bin=1):
+        """
+        :param pattern_size: The number of corners of the board (width, height).
+        :param max_views_per_bin: How many views of the same bin are accepted.
+        """
+        self.pattern_size = pattern_size
+        self.max_views_per_bin = max_views_per_bin
+        self._counts = {}
+
+    def bins(self, detections):
+        """
+        :param detections: The Detection of every camera for one view; all must have found the board.
+        :return: The bin key of each camera's detection.
+        """
+        return [view_bin(detection.corners, detection.image_size, self.pattern_size, detection.ids)
+                for detection in detections]
+
+    def is_redundant(self, detections):
+        """
+        A view is redundant when every camera's bin is already full.
+        :param detections: The Detection of every camera for one view.
+        """
+        return all(self._counts.get((camera, key), 0) >= self.max_views_per_bin
+                   for camera, key in enumerate(self.bins(detections)))
+
+    def add(self, detections):
+        """
+        Records an accepted view.
+        :param detections: The Detection of every camera for one view.
+        """
+        for camera, key in enumerate(self.bins(detections)):
+            self._counts[(camera, key)] = self._counts.get((camera, key), 0) + 1
+
+    def reset(self):
+        """
+        Forgets all recorded views.
+        """
+        self._counts.clear()
@@ -0,0 +1,48 @@
+import itertools
+import threading
+
+class FrameStore:
+    """
+    In-memory store of the decoded grayscale frames of every session while their detection is pending,
+    bounded by a memory budget. Every frame is released once its detection finished, so the budget
+    only covers the frames still waiting for or going through their detection.
+    """
+
+    def __init__(self, budget_bytes):
+        """
+        :param budget_bytes: The maximum number of bytes of frame data held across all sessions.
+        """
+        self.budget_bytes = budget_bytes
+        self.used_bytes = 0
+        self._frames = {}   # Session id -> {frame key: frame}
+        self._keys = itertools.count()
+        self._lock = threading.Lock()
+
+    def add(self, session_id, frame):
+        """
+        Stores a frame unless it would exceed the memory budget.
+        :param session_id: The session the frame belongs to.
+        :param frame: The decoded grayscale frame.
+        :return: The key to release the frame with, or None if the budget is exhausted.
+        """
+        with self._lock:
+            if self.used_bytes + frame.nbytes > self.budget_bytes:
+                return None
+            key = next(self._keys)
+            self._frames.setdefault(session_id, {})[key] = frame
+            self.used_bytes += frame.nbytes
+            return key
+
+    def release(self, session_id, key=None):
+        """
+        Drops frames of a session and returns their memory to the budget. Safe to call from any thread.
+        :param session_id: The session whose frames to drop.
+        :param key: The key of the frame to drop, None for all frames of the session.
+        """
+        with self._lock:
+            if key is None:
+                frames = self._frames.pop(session_id, {}).values()
+            else:
+                frame = self._frames.get(session_id, {}).pop(key, None)
+                frames = [] if frame is None else [frame]
+            self.used_bytes -= sum(frame.nbytes for frame in frames)
@@ -0,0 +1,82 @@
+import argparse
+import os
+import socket
+import threading
+import time
+
+from SocketFraming import FrameReader
+
+def legacy_receive(connection, frames):
+    """
+    Receives frames the way TcpServer used to: one recv per header byte and
+    the payload grown with buffer += data in 4096-byte chunks.
+    """
+    for _ in range(frames):
+        header_data = b''
+        while not header_data.endswith(b'\n'):
+            header_data += connection.recv(1)
+        length = int(header_data.decode('utf-8').strip().split("ImageData:")[1])
+        buffer = b''
+        while len(buffer) < length:
+            to_read = length - len(buffer)
+            buffer += connection.recv(4096 if to_read > 4096 else to_read)
+
+def buffered_receive(connection, frames):
+    """
+    Receives frames with the FrameReader: buffered header lines and recv_into the final payload buffer.
+    """
+    reader = FrameReader(connection)
+    for _ in range(frames):
+        length = int(reader.read_line().decode('utf-8').strip().split("ImageData:")[1])
+        buffer = bytearray(length)
+        view = memoryview(buffer)
+        received = 0
+        while received < length:
+            received += reader.recv_into(view[received:])
+
+def run(receive, payload, frames):
+    """
+    Streams frames over a loopback TCP connection and times their reception.
+    :param receive: The receive function to benchmark.
+    :param payload: The payload bytes sent in every frame.
+    :param frames: The number of frames to send.
+    :return: The elapsed wall time in seconds.
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as listener:
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        message = f"SendingLEFTImageData:{len(payload)}\n".encode() + payload
+
+        def send():
+            with socket.create_connection(listener.getsockname()) as client:
+                for _ in range(frames):
+                    client.sendall(message)
+
+        sender = threading.Thread(target=send)
+        sender.start()
+        connection, _ = listener.accept()
+        with connection:
+            start = time.perf_counter()
+            receive(connection, frames)
+            elapsed = time.perf_counter() - start
+        sender.join()
+    return elapsed
+
+def main():
+    """
+    Compares the legacy and buffered receive paths on loopback and reports MB/s and frames/s.
+    """
+    parser = argparse.ArgumentParser(description="Loopback benchmark of the image framing layer.")
+    parser.add_argument("--size", type=float, default=5.0, help="Frame payload size in MB.")
+    parser.add_argument("--frames", type=int, default=40, help="Number of frames per run.")
+    args = parser.parse_args()
+
+    payload = os.urandom(int(args.size * 1024 * 1024))
+    megabytes = len(payload) * args.frames / (1024 * 1024)
+    for name, receive in (("before (recv(1) + buffer +=)", legacy_receive),
+                          ("after (FrameReader + recv_into)", buffered_receive)):
+        elapsed = run(receive, payload, args.frames)
+        print(f"{name}: {megabytes / elapsed:.1f} MB/s, {args.frames / elapsed:.1f} frames/s")
+
+if __name__ == "__main__":
+    main()
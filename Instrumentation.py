@@ -0,0 +1,190 @@
+import bisect
+import logging
+import threading
+import time
+
+# Format of the server's log lines, also used by the calibration worker processes
+LOG_FORMAT = "%(asctime)s %(levelname)s %(message)s"
+
+# Histogram buckets in seconds, from sub-millisecond decodes to multi-second solves
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Histogram buckets in bytes, from compressed VGA frames to raw 12 MP frames
+SIZE_BUCKETS = tuple(2 ** exponent for exponent in range(14, 25))
+
+def configure_logging(level="INFO"):
+    """
+    Sends log records of the given level and above to stderr. Records below the level are dropped
+    before their message is formatted, so disabled debug logging costs one level check.
+    :param level: The minimum level as a name (DEBUG, INFO, WARNING, ERROR) or a logging constant.
+    """
+    logging.basicConfig(level=level, format=LOG_FORMAT)
+
+def _format_value(value):
+    """
+    :return: A sample value as text; integers are written in full, not in exponent notation.
+    """
+    if isinstance(value, int) or (isinstance(value, float) and value.is_integer() and abs(value) < 2 ** 53):
+        return str(int(value))
+    return repr(float(value))
+
+class Counter:
+    """
+    Monotonically increasing count.
+    """
+
+    kind = "counter"
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        """
+        :param amount: The amount to add, must not be negative.
+        """
+        with self._lock:
+            self.value += amount
+
+    def samples(self, name):
+        """
+        :param name: The metric name.
+        :return: The (sample name, value) pairs of the metric.
+        """
+        return [(name, self.value)]
+
+class Gauge:
+    """
+    Value read from a function whenever the metrics are rendered, such as a current memory use.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, function):
+        """
+        :param function: Returns the current value.
+        """
+        self.function = function
+
+    def samples(self, name):
+        """
+        :param name: The metric name.
+        :return: The (sample name, value) pairs of the metric.
+        """
+        return [(name, self.function())]
+
+class Histogram:
+    """
+    Distribution of observed values over fixed buckets, with their count and sum.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        """
+        :param buckets: The increasing upper bounds of the buckets; values above the last one are only counted.
+        """
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        """
+        :param value: The observed value.
+        """
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.bucket_counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def time(self):
+        """
+        :return: A context manager observing the seconds its block takes.
+        """
+        return _Timer(self)
+
+    def samples(self, name):
+        """
+        :param name: The metric name.
+        :return: The (sample name, value) pairs of the metric, with cumulative bucket counts.
+        """
+        with self._lock:
+            counts, total, value_sum = list(self.bucket_counts), self.count, self.sum
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            samples.append((f'{name}_bucket{{le="{_format_value(bound)}"}}', cumulative))
+        samples.append((f'{name}_bucket{{le="+Inf"}}', total))
+        samples.append((f"{name}_sum", value_sum))
+        samples.append((f"{name}_count", total))
+        return samples
+
+class _Timer:
+    """
+    Context manager observing the duration of its block in a histogram.
+    """
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+class MetricsRegistry:
+    """
+    In-process registry of named metrics, rendered in the Prometheus text format.
+    Metrics are updated from any thread; rendering reads a consistent snapshot of each metric.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, name, description, metric):
+        with self._lock:
+            if name in self._metrics:
+                raise ValueError(f"metric {name} is already registered")
+            self._metrics[name] = (description, metric)
+        return metric
+
+    def counter(self, name, description):
+        """
+        :return: A new Counter registered under name.
+        """
+        return self._register(name, description, Counter())
+
+    def gauge(self, name, description, function):
+        """
+        :param function: Returns the current value of the gauge.
+        :return: A new Gauge registered under name.
+        """
+        return self._register(name, description, Gauge(function))
+
+    def histogram(self, name, description, buckets=DURATION_BUCKETS):
+        """
+        :param buckets: The increasing upper bounds of the buckets.
+        :return: A new Histogram registered under name.
+        """
+        return self._register(name, description, Histogram(buckets))
+
+    def render(self):
+        """
+        :return: All metrics in the Prometheus text exposition format.
+        """
+        with self._lock:
+            metrics = list(self._metrics.items())
+        lines = []
+        for name, (description, metric) in metrics:
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            lines.extend(f"{sample} {_format_value(value)}" for sample, value in metric.samples(name))
+        return "\n".join(lines) + "\n"
@@ -1,6 +1,18 @@
+import functools
+import io
+import json
+import os
+import struct
 import numpy as np
 
-def load_camera_calibration_results(filename):
+CALIBRATION_ENCODINGS = ("JSON", "BINARY")
+
+# Order of the fields in the binary encoding of the stereo calibration data
+STEREO_CALIBRATION_FIELDS = ('rms_error', 'left_camera_matrix', 'left_distortion_coefficients', 'right_camera_matrix',
+                             'right_distortion_coefficients', 'rotation_matrix', 'translation_vector',
+                             'essential_matrix', 'fundamental_matrix')
+
+def load_camera_calibration_results(filename, verbose=False):
     # Load the NPZ file
     data = np.load(filename)
 
@@ -10,13 +22,21 @@ def load_camera_calibration_results(filename):
     rotation_vectors = data['rotation_vectors']
     translation_vectors = data['translation_vectors']
 
-    # Print out the results and return them
-    print("Camera Matrix:\n", camera_matrix)
-    print("Distortion Coefficients:\n", distortion_coefficients)
-    print("Rotation Vectors:\n", rotation_vectors)
-    print("Translation Vectors:\n", translation_vectors)
+    # Print out the results if asked to and return them
+    if verbose:
+        print("Camera Matrix:\n", camera_matrix)
+        print("Distortion Coefficients:\n", distortion_coefficients)
+        print("Rotation Vectors:\n", rotation_vectors)
+        print("Translation Vectors:\n", translation_vectors)
+
+    return {
+        'camera_matrix': camera_matrix,
+        'distortion_coefficients': distortion_coefficients,
+        'rotation_vectors': rotation_vectors,
+        'translation_vectors': translation_vectors
+    }
 
-def load_stereo_calibration_results(filename):
+def load_stereo_calibration_results(filename, verbose=False):
     # Load the NPZ file
     data = np.load(filename)
 
@@ -34,16 +54,17 @@ def load_stereo_calibration_results(filename):
     essential_matrix = data['essential_matrix']
     fundamental_matrix = data['fundamental_matrix']
 
-    # Print out the results
-    print("RMS Error:", rms_error)
-    print("Left Camera Matrix:\n", left_camera_matrix)
-    print("Left Distortion Coefficients (1D):", left_distortion_coefficients)
-    print("Right Camera Matrix:\n", right_camera_matrix)
-    print("Right Distortion Coefficients (1D):", right_distortion_coefficients)
-    print("Rotation Matrix:\n", rotation_matrix)
-    print("Translation Vector (1D):", translation_vector)
-    print("Essential Matrix:\n", essential_matrix)
-    print("Fundamental Matrix:\n", fundamental_matrix)
+    # Print out the results if asked to
+    if verbose:
+        print("RMS Error:", rms_error)
+        print("Left Camera Matrix:\n", left_camera_matrix)
+        print("Left Distortion Coefficients (1D):", left_distortion_coefficients)
+        print("Right Camera Matrix:\n", right_camera_matrix)
+        print("Right Distortion Coefficients (1D):", right_distortion_coefficients)
+        print("Rotation Matrix:\n", rotation_matrix)
+        print("Translation Vector (1D):", translation_vector)
+        print("Essential Matrix:\n", essential_matrix)
+        print("Fundamental Matrix:\n", fundamental_matrix)
 
     # Organize data into a dictionary for potential JSON serialization or other uses
     calibration_data = {
@@ -60,7 +81,84 @@ def load_stereo_calibration_results(filename):
 
     return calibration_data
 
+def load_view_errors(filename):
+    """
+    Loads the per-view reprojection errors of a single camera calibration.
+    :param filename: The path of the camera's NPZ file.
+    :return: A tuple (view_indices, view_errors, rejected_views), or None for results saved without them.
+    """
+    with np.load(filename) as data:
+        if 'view_errors' not in data:
+            return None
+        return data['view_indices'], data['view_errors'], data['rejected_views']
+
+def encode_calibration_json(calibration_data):
+    """
+    Encodes calibration data as JSON between the CalibrationDataStart and CalibrationDataEnd text markers.
+    :param calibration_data: The dictionary returned by load_stereo_calibration_results.
+    :return: The message as bytes.
+    """
+    return f"CalibrationDataStart\n{json.dumps(calibration_data)}\nCalibrationDataEnd".encode()
+
+def encode_calibration_binary(calibration_data):
+    """
+    Encodes calibration data as length-prefixed little-endian float64 values:
+    a "CalibrationDataBinary:<length>\\n" header line followed by <length> bytes holding, for every
+    field of STEREO_CALIBRATION_FIELDS in order, a uint32 value count and that many float64 values
+    (matrices row by row).
+    :param calibration_data: The dictionary returned by load_stereo_calibration_results.
+    :return: The message as bytes.
+    """
+    payload = bytearray()
+    for field in STEREO_CALIBRATION_FIELDS:
+        values = np.asarray(calibration_data[field], '<f8').reshape(-1)
+        payload += struct.pack('<I', values.size)
+        payload += values.tobytes()
+    return f"CalibrationDataBinary:{len(payload)}\n".encode() + bytes(payload)
+
+def _encode_calibration(calibration_data):
+    """
+    :return: The stereo calibration data in every encoding as {encoding: bytes}.
+    """
+    return {"JSON": encode_calibration_json(calibration_data), "BINARY": encode_calibration_binary(calibration_data)}
+
+@functools.lru_cache(maxsize=64)
+def _stereo_calibration_payloads(filename, modified, size):
+    """
+    Parses a stereo calibration file once per version and encodes it in every encoding.
+    modified and size identify the version of the file, so a rewritten file is parsed again.
+    """
+    return _encode_calibration(load_stereo_calibration_results(filename))
+
+@functools.lru_cache(maxsize=1024)
+def _stored_calibration_payloads(data):
+    """
+    Parses a stereo calibration file held in memory once per content and encodes it in every encoding.
+    """
+    return _encode_calibration(load_stereo_calibration_results(io.BytesIO(data)))
+
+def stereo_calibration_payload(filename, encoding="JSON"):
+    """
+    Returns the stereo calibration data of a file, ready to send. The encoded data is cached in memory
+    and only recomputed when the modification time or size of the file changed.
+    :param filename: The path of the stereo calibration NPZ file.
+    :param encoding: One of CALIBRATION_ENCODINGS.
+    :return: The encoded message as bytes.
+    """
+    stat = os.stat(filename)
+    return _stereo_calibration_payloads(os.path.abspath(filename), stat.st_mtime_ns, stat.st_size)[encoding]
+
+def stored_calibration_payload(data, encoding="JSON"):
+    """
+    Returns the stereo calibration data of an NPZ file held in memory, such as a record of the
+    CalibrationStore, ready to send. The encoded data is cached in memory by the file content.
+    :param data: The stereo calibration NPZ file as bytes.
+    :param encoding: One of CALIBRATION_ENCODINGS.
+    :return: The encoded message as bytes.
+    """
+    return _stored_calibration_payloads(data)[encoding]
+
 
 # Replace 'stereo_calibration_data.npz' with the path to your .npz file
-# load_stereo_calibration_results('stereo_calibration_data.npz')
-# load_camera_calibration_results('left_calibration_data.npz')
\ No newline at end of file
+# load_stereo_calibration_results('stereo_calibration_data.npz', verbose=True)
+# load_camera_calibration_results('left_calibration_data.npz', verbose=True)
\ No newline at end of file
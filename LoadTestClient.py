@@ -0,0 +1,349 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import Counter, deque
+
+import cv2
+import numpy as np
+
+from SingleCalibration import find_image_files
+from StreamingDetection import PAYLOAD_FORMATS, encode_image
+from TcpServer import HOST, PORT, REQUIRED_IMAGE_COUNT
+
+# Server messages that are not terminated by a newline
+UNTERMINATED_MESSAGES = (b"Calibrating...", b"Calibrated!", b"CalibrationFailed")
+CALIBRATION_DATA_START = b"CalibrationDataStart\n"
+CALIBRATION_DATA_END = b"\nCalibrationDataEnd"
+
+def parse_message(buffer):
+    """
+    Splits the next server message off the received bytes.
+    :param buffer: The received bytes not parsed yet.
+    :return: A tuple (kind, content, length) of the message kind (e.g. Ack, Calibrated!, CalibrationData), its
+             text line or calibration data and its length in bytes, or None if the message is incomplete.
+    """
+    for message in UNTERMINATED_MESSAGES + (CALIBRATION_DATA_START,):
+        if len(buffer) < len(message) and message.startswith(buffer):
+            return None
+    for message in UNTERMINATED_MESSAGES:
+        if buffer.startswith(message):
+            return message.decode(), None, len(message)
+    if buffer.startswith(CALIBRATION_DATA_START):
+        end = buffer.find(CALIBRATION_DATA_END)
+        if end < 0:
+            return None
+        return "CalibrationData", json.loads(buffer[len(CALIBRATION_DATA_START):end]), end + len(CALIBRATION_DATA_END)
+    newline = buffer.find(b"\n")
+    if newline < 0:
+        return None
+    line = bytes(buffer[:newline]).decode()
+    if line.startswith("CalibrationDataBinary:"):
+        end = newline + 1 + int(line.split(":")[1])
+        if len(buffer) < end:
+            return None
+        return "CalibrationData", bytes(buffer[newline + 1:end]), end
+    return line.split(":", 1)[0], line, newline + 1
+
+def load_frames(directory, sides, count, payload_format, keep_frames=False):
+    """
+    Loads an image set once and encodes it in the payload format the rigs send.
+    :param directory: The directory holding one folder of <SIDE>_<n>.png images per camera side.
+    :param sides: The folders to read, e.g. (LEFT, RIGHT).
+    :param count: The number of images per side.
+    :param payload_format: One of PAYLOAD_FORMATS; PNG files are sent as they are.
+    :param keep_frames: Whether to keep the decoded grayscale frames, e.g. to tag them.
+    :return: {side: [(payload, frame)]}, with frame None unless it was decoded.
+    """
+    frames = {}
+    for side in sides:
+        paths = find_image_files(os.path.join(directory, side), side, count)
+        if len(paths) < count:
+            raise ValueError(f"found {len(paths)} of {count} {side} images in {directory}")
+        frames[side] = []
+        for path in paths:
+            if payload_format == "PNG" and not keep_frames:
+                with open(path, "rb") as image_file:
+                    frames[side].append((image_file.read(), None))
+            else:
+                frame = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+                frames[side].append((bytes(encode_image(frame, payload_format)), frame))
+    return frames
+
+def tagged_payload(frame, payload_format, tag):
+    """
+    Encodes a frame with its first pixels replaced by a tag, so that the server sees new content and
+    neither its detection cache nor its result cache answer for it.
+    :param frame: The grayscale frame.
+    :param payload_format: One of PAYLOAD_FORMATS.
+    :param tag: A number unique to the rig and image set.
+    :return: The payload bytes.
+    """
+    frame = frame.copy()
+    frame.reshape(-1)[:8] = np.frombuffer(tag.to_bytes(8, "little"), np.uint8)
+    return bytes(encode_image(frame, payload_format))
+
+class RigClient:
+    """
+    One simulated camera rig: a connection that streams image sets at a fixed image rate, and a
+    receiver that parses the server's replies and times every image set until its calibration arrives.
+    With flow control, images the server turns away are sent again the way the protocol asks.
+    """
+
+    def __init__(self, rig, frames, args, stats):
+        """
+        :param rig: The number of the rig.
+        :param frames: The image set as returned by load_frames.
+        :param args: The parsed command line arguments.
+        :param stats: The Counter shared by all rigs for the message and failure counts.
+        """
+        self.rig = rig
+        self.frames = frames
+        self.args = args
+        self.stats = stats
+        self.sides = list(frames)
+        self.latencies = []         # Seconds from the first image of each calibrated set to its calibration
+        self.images_sent = 0
+        self.bytes_sent = 0
+        self.writer = None
+        self._set_starts = deque()  # Send time of the first image of every set still waiting for its result
+        self._sets_started = 0
+        self._finished = asyncio.Event()
+        self._replies = {}          # Reply kind -> future, for the replies to commands
+        self._credits = None
+        self._sent = {side: [] for side in self.sides}  # The image of every flow control sequence number per side
+        self._in_flight = 0
+        self._settled = asyncio.Event()     # Set while no image waits for its flow control reply
+        self._settled.set()
+        self._busy = []
+
+    async def run(self):
+        """
+        Connects, streams all image sets and waits for their calibrations, at most args.timeout seconds.
+        """
+        deadline = time.perf_counter() + self.args.timeout
+        try:
+            reader, self.writer = await asyncio.wait_for(
+                asyncio.open_connection(self.args.host, self.args.port), self.args.timeout)
+        except (OSError, asyncio.TimeoutError):
+            self.stats["connection_failures"] += 1
+            self.stats["failed_sets"] += self.args.sets
+            return
+        receiver = asyncio.create_task(self.receive(reader))
+        sender = None
+        try:
+            await asyncio.wait_for(self.command(f"SetRig:loadtest-{self.rig}", "Rig"), self.args.timeout)
+            if self.args.flow_control:
+                reply = await asyncio.wait_for(
+                    self.command(f"EnableFlowControl:{self.args.flow_control}", "FlowControl"), self.args.timeout)
+                self._credits = asyncio.Semaphore(int(reply.split(":")[1]))
+            sender = asyncio.create_task(self.stream())
+            finished = asyncio.create_task(self._finished.wait())
+            # Returns early if sending fails, otherwise once the sets are complete or the server closed
+            await asyncio.wait((sender, finished), timeout=max(deadline - time.perf_counter(), 0),
+                               return_when=asyncio.FIRST_EXCEPTION)
+            finished.cancel()
+            if (sender.done() and sender.exception() is not None) or receiver.done():
+                self.stats["connection_failures"] += 1
+            elif not self._finished.is_set():
+                self.stats["timed_out_sets"] += self.args.sets - len(self.latencies)
+        except asyncio.TimeoutError:
+            self.stats["timed_out_sets"] += self.args.sets - len(self.latencies)
+        except (OSError, EOFError):
+            self.stats["connection_failures"] += 1
+        finally:
+            for task in (sender, receiver):
+                if task is not None:
+                    task.cancel()
+            self.writer.close()
+            self.stats["failed_sets"] += self.args.sets - sum(latency is not None for latency in self.latencies)
+
+    async def command(self, line, reply_kind):
+        """
+        Sends a command and waits for its reply.
+        :return: The reply line.
+        """
+        reply = self._replies[reply_kind] = asyncio.get_running_loop().create_future()
+        self.writer.write(f"{line}\n".encode())
+        return await reply
+
+    async def stream(self):
+        """
+        Sends args.sets image sets at args.fps images per second, as fast as possible without a rate.
+        """
+        queue = deque((image_set, index, side) for image_set in range(self.args.sets)
+                      for index in range(len(self.frames[self.sides[0]])) for side in self.sides)
+        start = time.perf_counter()
+        while queue or self._credits is not None:
+            if not queue:
+                # The last images may still be turned away
+                await self._settled.wait()
+                if not self._busy:
+                    break
+                await self.go_back(queue)
+                continue
+            if self.args.fps:
+                await asyncio.sleep(max(0.0, start + self.images_sent / self.args.fps - time.perf_counter()))
+            if self._credits is not None:
+                await self._credits.acquire()
+                if self._busy:
+                    self._credits.release()
+                    await self.go_back(queue)
+                    continue
+            image_set, index, side = queue.popleft()
+            if image_set == self._sets_started:
+                self._sets_started += 1
+                self._set_starts.append(time.perf_counter())
+            await self.send_image(image_set, index, side)
+
+    async def go_back(self, queue):
+        """
+        Sends the images the server turned away again: waits for the replies of the images in flight,
+        resumes the server and queues the turned away images in their order.
+        """
+        await self._settled.wait()
+        await self.command("Resume", "Resumed")
+        queue.extendleft(reversed(self._busy))
+        self._busy.clear()
+        self.stats["resumes"] += 1
+
+    async def send_image(self, image_set, index, side):
+        """
+        Sends one image of a set with its header.
+        """
+        payload, frame = self.frames[side][index]
+        if self.args.unique:
+            tag = (self.rig * self.args.sets + image_set) * 2 + 1
+            payload = await asyncio.to_thread(tagged_payload, frame, self.args.format, tag)
+        header = f"Sending{self.args.camera_side or side}ImageData:{len(payload)}"
+        if self.args.format != "PNG":
+            header += f":{self.args.format}:{frame.shape[1]}x{frame.shape[0]}"
+        if self._credits is not None:
+            self._sent[side].append((image_set, index, side))
+            self._in_flight += 1
+            self._settled.clear()
+        self.writer.write(f"{header}\n".encode())
+        self.writer.write(payload)
+        await self.writer.drain()
+        self.images_sent += 1
+        self.bytes_sent += len(payload)
+
+    async def receive(self, reader):
+        """
+        Parses the server's replies until the server closes the connection.
+        """
+        buffer = bytearray()
+        while data := await reader.read(65536):
+            buffer += data
+            while (message := parse_message(buffer)) is not None:
+                kind, content, length = message
+                del buffer[:length]
+                self.handle(kind, content)
+        for reply in self._replies.values():
+            if not reply.done():
+                reply.set_exception(EOFError("connection closed by the server"))
+        self._finished.set()
+
+    def handle(self, kind, content):
+        """
+        Handles one server message: flow control replies return credits, and the calibration data (or
+        Calibrated! in single mode, CalibrationFailed on failure) completes the oldest open image set.
+        """
+        self.stats[kind] += 1
+        if kind in self._replies and not self._replies[kind].done():
+            self._replies[kind].set_result(content)
+        elif kind in ("Ack", "Busy", "Rejected") and self._credits is not None:
+            side, number = content.split(":")[1:3]
+            if kind == "Busy":
+                self._busy.append(self._sent[self.sides[0] if self.args.camera_side else side][int(number) - 1])
+            self._in_flight -= 1
+            if not self._in_flight:
+                self._settled.set()
+            self._credits.release()
+        elif kind == "CalibrationFailed" and self._set_starts:
+            self._set_starts.popleft()
+            self._complete(None)
+        elif (kind == "CalibrationData" or kind == "Calibrated!" and self.args.camera_side) and self._set_starts:
+            self._complete(time.perf_counter() - self._set_starts.popleft())
+
+    def _complete(self, latency):
+        """
+        Records the outcome of an image set, its time to calibration or None if it failed.
+        """
+        self.latencies.append(latency)
+        if len(self.latencies) == self.args.sets:
+            self._finished.set()
+
+async def run_load(args, frames):
+    """
+    Starts args.rigs rigs, spread over args.ramp seconds, and waits for all of them.
+    :return: The RigClient of every rig, the Counter of their messages and failures, and the wall time in seconds.
+    """
+    stats = Counter()
+    clients = [RigClient(rig, frames, args, stats) for rig in range(args.rigs)]
+
+    async def start(client):
+        await asyncio.sleep(args.ramp * client.rig / args.rigs)
+        await client.run()
+
+    begin = time.perf_counter()
+    await asyncio.gather(*(start(client) for client in clients))
+    return clients, stats, time.perf_counter() - begin
+
+def report(args, clients, stats, elapsed):
+    """
+    Prints the throughput, the time-to-calibration percentiles and the failure counts of a run.
+    """
+    latencies = np.array([latency for client in clients for latency in client.latencies if latency is not None])
+    images = sum(client.images_sent for client in clients)
+    megabytes = sum(client.bytes_sent for client in clients) / (1024 * 1024)
+    pace = f"{args.fps:g} images/s per rig" if args.fps else "unpaced"
+    options = (f", flow control window {args.flow_control}" if args.flow_control else "") + \
+        (", unique frames" if args.unique else "")
+    print(f"{args.rigs} rigs x {args.sets} sets of {args.count} {args.mode} images, {args.format}, {pace}{options}")
+    print(f"Wall time {elapsed:.2f} s")
+    print(f"Throughput: {images / elapsed:.1f} images/s, {megabytes / elapsed:.1f} MB/s, "
+          f"{len(latencies) / elapsed:.2f} calibrations/s")
+    if len(latencies):
+        p50, p99 = np.percentile(latencies, [50, 99])
+        print(f"Time to calibration: p50 {p50:.2f} s, p99 {p99:.2f} s, max {latencies.max():.2f} s "
+              f"over {len(latencies)} calibrations")
+    print(f"Failures: {stats['failed_sets']} sets ({stats['CalibrationFailed']} failed calibrations, "
+          f"{stats['timed_out_sets']} timed out), {stats['connection_failures']} connections, "
+          f"{stats['Rejected']} rejected images")
+    if args.flow_control:
+        print(f"Flow control: {stats['Ack']} acked, {stats['Busy']} busy, {stats['resumes']} resumes")
+
+def main():
+    """
+    Replays the bundled image sets from many simulated rigs against a running TcpServer.
+    """
+    parser = argparse.ArgumentParser(description="Load test a running calibration server with simulated rigs.")
+    parser.add_argument("--host", default=HOST, help="Server address.")
+    parser.add_argument("--port", type=int, default=PORT, help="Server port.")
+    parser.add_argument("--rigs", type=int, default=4, help="Number of concurrent rigs.")
+    parser.add_argument("--sets", type=int, default=1, help="Image sets each rig sends.")
+    parser.add_argument("--fps", type=float, default=0.0, help="Images per second per rig, 0 to send unpaced.")
+    parser.add_argument("--ramp", type=float, default=0.0, help="Seconds over which the rigs connect.")
+    parser.add_argument("--mode", choices=("STEREO", "SINGLE"), default="STEREO",
+                        help="The server's CALIBRATION_MODE; SINGLE sends the LEFT images.")
+    parser.add_argument("--images", default=".", help="Directory holding the LEFT and RIGHT image folders.")
+    parser.add_argument("--count", type=int, default=REQUIRED_IMAGE_COUNT,
+                        help="Images per side and set, the server's REQUIRED_IMAGE_COUNT.")
+    parser.add_argument("--format", choices=PAYLOAD_FORMATS, default="PNG", help="Payload format of the images.")
+    parser.add_argument("--unique", action="store_true",
+                        help="Tag the images of every rig and set so the server's caches do not answer for them.")
+    parser.add_argument("--flow-control", type=int, default=0, metavar="WINDOW",
+                        help="Enable flow control with this window, 0 to send without per-image replies.")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Seconds each rig may take for all its sets.")
+    args = parser.parse_args()
+    args.camera_side = "SINGLE" if args.mode == "SINGLE" else None
+
+    sides = ("LEFT",) if args.mode == "SINGLE" else ("LEFT", "RIGHT")
+    frames = load_frames(args.images, sides, args.count, args.format, keep_frames=args.unique)
+    clients, stats, elapsed = asyncio.run(run_load(args, frames))
+    report(args, clients, stats, elapsed)
+
+if __name__ == "__main__":
+    main()
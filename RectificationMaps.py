@@ -0,0 +1,112 @@
+import os
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+RECTIFICATION_FILE = 'stereo_rectification.npz'               # Rectification transforms
+MAP_XY_FILE = 'stereo_rectification_map_xy.npy'               # Fixed-point pixel positions, (2, height, width, 2) int16
+MAP_INTERPOLATION_FILE = 'stereo_rectification_map_interp.npy'  # Interpolation table indices, (2, height, width) uint16
+
+# The rectification of a stereo pair. map_xy[camera] and map_interpolation[camera] (0 for left, 1 for right)
+# are the two maps cv2.remap takes for that camera.
+RectificationMaps = namedtuple("RectificationMaps", ["transforms", "map_xy", "map_interpolation"])
+
+def compute_rectification_maps(mtx_left, dist_left, mtx_right, dist_right, R, T, image_size):
+    """
+    Computes the rectification transforms of a calibrated stereo pair and the remap tables of both cameras.
+    The tables use OpenCV's compact fixed-point format (CV_16SC2 + interpolation indices) instead of float maps.
+    :param image_size: The image size as (width, height).
+    :return: A RectificationMaps whose maps are in-memory arrays.
+    """
+    R1, R2, P1, P2, Q, roi_left, roi_right = cv2.stereoRectify(mtx_left, dist_left, mtx_right, dist_right,
+                                                               image_size, R, T)
+    map_xy = np.empty((2, image_size[1], image_size[0], 2), np.int16)
+    map_interpolation = np.empty((2, image_size[1], image_size[0]), np.uint16)
+    for camera, (mtx, dist, rotation, projection) in enumerate([(mtx_left, dist_left, R1, P1),
+                                                                (mtx_right, dist_right, R2, P2)]):
+        map_xy[camera], map_interpolation[camera] = cv2.initUndistortRectifyMap(mtx, dist, rotation, projection,
+                                                                                 image_size, cv2.CV_16SC2)
+    transforms = {
+        'left_rectification': R1,           # Rotation of the left camera into the rectified frame.
+        'right_rectification': R2,          # Rotation of the right camera into the rectified frame.
+        'left_projection': P1,              # Projection matrix of the rectified left camera.
+        'right_projection': P2,             # Projection matrix of the rectified right camera.
+        'disparity_to_depth': Q,            # Disparity-to-depth mapping matrix.
+        'left_valid_roi': np.array(roi_left),   # Valid pixel rectangle (x, y, width, height) of the left image.
+        'right_valid_roi': np.array(roi_right), # Valid pixel rectangle (x, y, width, height) of the right image.
+        'image_size': np.array(image_size)
+    }
+    return RectificationMaps(transforms, map_xy, map_interpolation)
+
+def _save_atomically(filename, save):
+    """
+    Writes a file under a temporary name and moves it into place, so processes that have the
+    previous version memory-mapped keep reading consistent data.
+    """
+    temporary = filename + '.tmp'
+    with open(temporary, 'wb') as output_file:
+        save(output_file)
+    os.replace(temporary, filename)
+
+def save_rectification_maps(maps, output_dir="."):
+    """
+    Saves the rectification of a stereo pair next to its stereo_calibration_data.npz.
+    The maps are plain .npy files so that load_rectification_maps can memory-map them.
+    :param maps: The RectificationMaps to save.
+    :param output_dir: The directory the calibration results are saved in.
+    """
+    _save_atomically(os.path.join(output_dir, RECTIFICATION_FILE), lambda f: np.savez(f, **maps.transforms))
+    _save_atomically(os.path.join(output_dir, MAP_XY_FILE), lambda f: np.save(f, maps.map_xy))
+    _save_atomically(os.path.join(output_dir, MAP_INTERPOLATION_FILE), lambda f: np.save(f, maps.map_interpolation))
+
+def move_rectification_maps(source_dir, target_dir):
+    """
+    Moves the saved rectification of a calibration into another directory, replacing the rectification
+    held there. Processes that have the replaced maps memory-mapped keep reading them until they let go.
+    :param source_dir: The directory the rectification was saved in.
+    :param target_dir: The directory to move it to, created if it does not exist.
+    """
+    os.makedirs(target_dir, exist_ok=True)
+    for filename in (RECTIFICATION_FILE, MAP_XY_FILE, MAP_INTERPOLATION_FILE):
+        os.replace(os.path.join(source_dir, filename), os.path.join(target_dir, filename))
+
+def rectification_from_calibration(calibration_file, output_dir=None):
+    """
+    Computes and saves the rectification of an existing stereo calibration result.
+    :param calibration_file: The path of the stereo_calibration_data.npz file.
+    :param output_dir: The directory to save to, defaults to the directory of the calibration file.
+    :return: The RectificationMaps.
+    """
+    data = np.load(calibration_file)
+    if 'image_size' not in data:
+        raise ValueError(f"{calibration_file} has no image size; calibrate again to compute its rectification.")
+    maps = compute_rectification_maps(data['left_camera_matrix'], data['left_distortion_coefficients'],
+                                      data['right_camera_matrix'], data['right_distortion_coefficients'],
+                                      data['rotation_matrix'], data['translation_vector'],
+                                      tuple(int(v) for v in data['image_size']))
+    save_rectification_maps(maps, output_dir or os.path.dirname(calibration_file) or ".")
+    return maps
+
+def load_rectification_maps(directory="."):
+    """
+    Fetches the precomputed rectification of a calibration. The maps are memory-mapped read-only,
+    so every process using them shares the same pages and nothing is recomputed or copied.
+    :param directory: The directory holding the calibration results.
+    :return: A RectificationMaps.
+    """
+    with np.load(os.path.join(directory, RECTIFICATION_FILE)) as data:
+        transforms = {name: data[name] for name in data.files}
+    map_xy = np.load(os.path.join(directory, MAP_XY_FILE), mmap_mode='r')
+    map_interpolation = np.load(os.path.join(directory, MAP_INTERPOLATION_FILE), mmap_mode='r')
+    return RectificationMaps(transforms, map_xy, map_interpolation)
+
+def rectify(image, maps, camera):
+    """
+    Rectifies an image of one camera of the pair.
+    :param image: The image to rectify.
+    :param maps: The RectificationMaps of the pair.
+    :param camera: 0 for the left camera, 1 for the right camera.
+    :return: The rectified image.
+    """
+    return cv2.remap(image, maps.map_xy[camera], maps.map_interpolation[camera], cv2.INTER_LINEAR)
@@ -0,0 +1,109 @@
+import glob
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from RectificationMaps import MAP_XY_FILE, load_rectification_maps, move_rectification_maps, rectify
+from StreamingDetection import decode_image, encode_image
+
+# Prefix of the directory of every rig's maps; it keeps rig IDs such as ".." from naming another directory
+RIG_DIRECTORY_PREFIX = "rig_"
+
+def rig_maps_directory(maps_directory, rig):
+    """
+    :param maps_directory: The directory holding the rectification maps of every rig.
+    :param rig: The rig ID.
+    :return: The directory holding the maps of the rig's latest stereo calibration.
+    """
+    return os.path.join(maps_directory, RIG_DIRECTORY_PREFIX + rig)
+
+class RectificationError(Exception):
+    """
+    A stereo pair that cannot be rectified; the message is the reason reported to the client.
+    """
+
+def rectify_pair(maps, left_data, right_data, payload_format="PNG", size=None):
+    """
+    Decodes, rectifies and encodes a stereo pair. Runs on a worker thread; cv2 releases the GIL
+    while decoding, remapping and encoding, so pairs are processed in parallel.
+    :param maps: The RectificationMaps to use.
+    :param left_data: The left image payload.
+    :param right_data: The right image payload.
+    :param payload_format: The payload format of both images, also used for the rectified images.
+    :param size: The frame size as (width, height) for the GRAY8 formats.
+    :return: A tuple (left payload, right payload, (width, height)) of the rectified pair.
+    :raises RectificationError: If an image cannot be decoded or does not match the calibration.
+    """
+    width, height = (int(v) for v in maps.transforms['image_size'])
+    rectified = []
+    for camera, image_data in enumerate((left_data, right_data)):
+        frame = decode_image(image_data, payload_format, size)
+        if frame is None:
+            raise RectificationError("DECODE")
+        if frame.shape != (height, width):
+            raise RectificationError("SIZE_MISMATCH")
+        rectified.append(encode_image(rectify(frame, maps, camera), payload_format))
+    return rectified[0], rectified[1], (width, height)
+
+class RectificationService:
+    """
+    Rectifies stereo pairs for clients with the remap tables of the latest stereo calibration of their rig,
+    on its own thread pool so that rectification does not hold up corner detection. The maps of every rig
+    are loaded once, memory-mapped, and kept until a newer calibration of the rig replaces them.
+    """
+
+    def __init__(self, maps_directory, workers=None):
+        """
+        :param maps_directory: The directory holding the rectification maps of every rig, see rig_maps_directory.
+        :param workers: The number of rectification threads, defaults to the executor's choice.
+        """
+        self.maps_directory = maps_directory
+        self._maps = {}     # Rig ID -> RectificationMaps of its latest stereo calibration
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rectifier")
+
+    def publish_calibration(self, rig, directory):
+        """
+        Moves the rectification maps of a new stereo calibration out of its result directory into the
+        directory of its rig, replacing the maps of the rig's previous calibration, and switches the rig
+        to them. Only the latest maps of every rig are kept on disk, so the result directories do not
+        pile them up. Pairs already queued keep the maps they started with.
+        :param rig: The calibrated rig.
+        :param directory: The directory the calibration results and their rectification maps were saved in.
+        """
+        maps_directory = rig_maps_directory(self.maps_directory, rig)
+        # Calibrations of the same rig finishing together must not mix the files of both
+        with self._lock:
+            move_rectification_maps(directory, maps_directory)
+            self._maps[rig] = load_rectification_maps(maps_directory)
+
+    def load_calibrations(self):
+        """
+        Loads the maps of the latest stereo calibration of every rig, e.g. after a restart.
+        :return: The rigs whose maps were found, sorted.
+        """
+        pattern = os.path.join(glob.escape(self.maps_directory), RIG_DIRECTORY_PREFIX + "*", MAP_XY_FILE)
+        for filename in glob.glob(pattern):
+            maps_directory = os.path.dirname(filename)
+            rig = os.path.basename(maps_directory)[len(RIG_DIRECTORY_PREFIX):]
+            with self._lock:
+                self._maps.setdefault(rig, load_rectification_maps(maps_directory))
+        return sorted(self._maps)
+
+    def submit(self, rig, left_data, right_data, payload_format="PNG", size=None):
+        """
+        Queues the rectification of a stereo pair of a rig.
+        :param rig: The rig the pair was taken with.
+        :return: A future resolving to the result of rectify_pair.
+        :raises RectificationError: If the rig has no stereo calibration to rectify with.
+        """
+        maps = self._maps.get(rig)
+        if maps is None:
+            raise RectificationError("NO_CALIBRATION")
+        return self._executor.submit(rectify_pair, maps, left_data, right_data, payload_format, size)
+
+    def shutdown(self):
+        """
+        Stops the worker threads.
+        """
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,94 @@
+import cv2
+import numpy as np
+
+def rodrigues(rvecs):
+    """
+    Converts rotation vectors to rotation matrices, for all views at once.
+    :param rvecs: The rotation vectors, (V, 3) or a list of V (3, 1) arrays.
+    :return: The rotation matrices, (V, 3, 3).
+    """
+    rvecs = np.asarray(rvecs, np.float64).reshape(-1, 3)
+    theta = np.linalg.norm(rvecs, axis=1)
+    axis = rvecs / np.where(theta > 0, theta, 1)[:, None]
+    x, y, z = axis.T
+    zero = np.zeros_like(x)
+    cross = np.stack([zero, -z, y, z, zero, -x, -y, x, zero], axis=1).reshape(-1, 3, 3)
+    cos, sin = np.cos(theta)[:, None, None], np.sin(theta)[:, None, None]
+    return cos * np.eye(3) + (1 - cos) * axis[:, :, None] * axis[:, None, :] + sin * cross
+
+def project_points(objpoints, rvecs, tvecs, camera_matrix, distortion_coefficients):
+    """
+    Projects the object points of all views in one batch, like cv2.projectPoints does for a single view.
+    Supports the 4, 5 and 8 coefficient distortion models; other models fall back to cv2.projectPoints.
+    :param objpoints: The object points, (V, N, 3).
+    :param rvecs: The rotation vector of each view.
+    :param tvecs: The translation vector of each view.
+    :param camera_matrix: The camera matrix.
+    :param distortion_coefficients: The distortion coefficients.
+    :return: The image points, (V, N, 2).
+    """
+    objpoints = np.asarray(objpoints, np.float64)
+    dist = np.asarray(distortion_coefficients, np.float64).reshape(-1)
+    if dist.size > 8 and not dist[8:].any():
+        dist = dist[:8]     # Unused thin prism and tilt coefficients
+    if dist.size not in (4, 5, 8):
+        return np.stack([cv2.projectPoints(points, rvec, tvec, camera_matrix, dist)[0].reshape(-1, 2)
+                         for points, rvec, tvec in zip(objpoints, rvecs, tvecs)])
+    k = np.zeros(8)
+    k[:dist.size] = dist
+    k1, k2, p1, p2, k3, k4, k5, k6 = k
+
+    camera = objpoints @ rodrigues(rvecs).transpose(0, 2, 1) + np.asarray(tvecs, np.float64).reshape(-1, 1, 3)
+    z = camera[..., 2]
+    z = np.where(z != 0, 1 / z, 1)
+    x, y = camera[..., 0] * z, camera[..., 1] * z
+
+    r2 = x * x + y * y
+    r4, r6 = r2 * r2, r2 * r2 * r2
+    radial = (1 + k1 * r2 + k2 * r4 + k3 * r6) / (1 + k4 * r2 + k5 * r4 + k6 * r6)
+    xd = x * radial + 2 * p1 * x * y + p2 * (r2 + 2 * x * x)
+    yd = y * radial + p1 * (r2 + 2 * y * y) + 2 * p2 * x * y
+
+    mtx = np.asarray(camera_matrix, np.float64)
+    return np.stack([mtx[0, 0] * xd + mtx[0, 1] * yd + mtx[0, 2], mtx[1, 1] * yd + mtx[1, 2]], axis=-1)
+
+def _pad_views(points, count, dimensions):
+    """
+    Stacks views with different numbers of points into one array, padding the shorter views with NaN.
+    :param points: The points of each view.
+    :param count: The number of points of the longest view.
+    :param dimensions: The number of coordinates per point.
+    :return: The padded points, (V, count, dimensions).
+    """
+    padded = np.full((len(points), count, dimensions), np.nan)
+    for view, view_points in zip(padded, points):
+        view_points = np.asarray(view_points, np.float64).reshape(-1, dimensions)
+        view[:len(view_points)] = view_points
+    return padded
+
+def reprojection_errors(objpoints, imgpoints, rvecs, tvecs, camera_matrix, distortion_coefficients):
+    """
+    Computes the reprojection error of every corner and view of a calibration in batched NumPy.
+    The RMS over all corners equals the RMS error reported by cv2.calibrateCamera.
+    :param objpoints: The object points of each view. Views with fewer corners, such as partial ChArUco
+                      detections, are padded to the longest view and projected in the same batch.
+    :param imgpoints: The detected image points of each view.
+    :param rvecs: The rotation vector of each view.
+    :param tvecs: The translation vector of each view.
+    :param camera_matrix: The camera matrix.
+    :param distortion_coefficients: The distortion coefficients.
+    :return: A tuple (corner_errors, view_errors): the distance in pixels between each detected and
+             reprojected corner, (V, N) with N the corners of the longest view and NaN past the end of
+             shorter views, and the RMS error of each view, (V,).
+    """
+    counts = [len(points) for points in objpoints]
+    if min(counts) == max(counts):
+        projected = project_points(np.stack(objpoints), rvecs, tvecs, camera_matrix, distortion_coefficients)
+        detected = np.stack(imgpoints).astype(np.float64).reshape(projected.shape)
+        squared = np.sum((projected - detected) ** 2, axis=-1)
+        return np.sqrt(squared), np.sqrt(squared.mean(axis=1))
+    projected = project_points(_pad_views(objpoints, max(counts), 3), rvecs, tvecs, camera_matrix,
+                               distortion_coefficients)
+    detected = _pad_views(imgpoints, max(counts), 2)
+    squared = np.sum((projected - detected) ** 2, axis=-1)
+    return np.sqrt(squared), np.sqrt(np.nanmean(squared, axis=1))
@@ -1,8 +1,48 @@
+import abc
+import logging
 import os
 import cv2
 import numpy as np
-import socket
-import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from ReprojectionErrors import reprojection_errors
+
+# Result of detecting the calibration target in one image, shared by the intrinsic and stereo stages.
+# ids holds the index of each detected corner in the target's object points for partial detections,
+# and is None when all corners were found in order.
+Detection = namedtuple("Detection", ["found", "corners", "image_size", "ids"], defaults=(None,))
+
+class CameraCalibration(namedtuple("CameraCalibration", ["rms_error", "camera_matrix", "distortion_coefficients"])):
+    """
+    Result of a single camera calibration. It unpacks like the (ret, mtx, dist) tuple camera_calibration
+    returned before; the per-view results are attributes. view_indices, view_errors and rejected_views have
+    one entry per view with a detected board: its index in the input, its RMS reprojection error in pixels
+    and whether it was left out of the final solve.
+    """
+
+    def __new__(cls, rms_error, camera_matrix, distortion_coefficients, view_indices, view_errors, rejected_views):
+        calibration = super().__new__(cls, rms_error, camera_matrix, distortion_coefficients)
+        calibration.view_indices = view_indices
+        calibration.view_errors = view_errors
+        calibration.rejected_views = rejected_views
+        return calibration
+
+    def __getnewargs__(self):
+        return (*self, self.view_indices, self.view_errors, self.rejected_views)
+
+# Termination criteria for the subpixel corner refinement
+SUBPIX_CRITERIA = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 100, 0.0001)
+
+# Flags for the coarse search on the downscaled image; the fast check rejects frames without a board early
+COARSE_DETECTION_FLAGS = cv2.CALIB_CB_ADAPTIVE_THRESH + cv2.CALIB_CB_NORMALIZE_IMAGE + cv2.CALIB_CB_FAST_CHECK
+
+MAX_REJECTION_ROUNDS = 5        # Re-solves after dropping outlier views
+MIN_CALIBRATION_VIEWS = 5       # Outlier rejection never leaves fewer views than this
+MIN_PARTIAL_CORNERS = 6         # Partial detections with fewer corners are discarded
+
+logger = logging.getLogger(__name__)
 
 def find_image_files(base_path, prefix, count):
     """
@@ -19,65 +59,436 @@ def find_image_files(base_path, prefix, count):
         if os.path.exists(filename):
             image_files.append(filename)
         else:
-            print(f"Missing image file: {filename}")
+            logger.warning("Missing image file: %s", filename)
             break
     return image_files
 
-def camera_calibration(images, square_size, pattern_size, prefix):
+def chessboard_object_points(square_size, pattern_size):
     """
-    Perform calibration for a single camera using chessboard images.
+    Build the 3D object points of the chessboard corners in the board plane.
     
-    :param images: The list of image paths used for calibration.
     :param square_size: The size of one square on the chessboard.
-    :param pattern_size: The number of squares on the chessboard (width, height).
-    :return: The camera matrix and distortion coefficients.
+    :param pattern_size: The number of inner corners on the chessboard (width, height).
+    :return: An (N, 3) float32 array of corner coordinates.
     """
-    # Prepare object points based on the chessboard pattern and size
     objp = np.zeros((pattern_size[0] * pattern_size[1], 3), np.float32)
     objp[:, :2] = np.mgrid[0:pattern_size[0], 0:pattern_size[1]].T.reshape(-1, 2) * square_size
+    return objp
 
-    # Arrays to store object points and image points
-    objpoints = []  # 3d points in real world space
-    imgpoints = []  # 2d points in image plane
+def find_chessboard_corners(gray, pattern_size, scale=1.0):
+    """
+    Detect the chessboard corners in a grayscale image and refine them to subpixel accuracy.
+    
+    With a scale below 1 the board is first searched on a downscaled copy of the image with
+    the fast check enabled, and the corners found there are refined on the full resolution image.
+    
+    :param gray: The grayscale image.
+    :param pattern_size: The number of inner corners on the chessboard (width, height).
+    :param scale: The downscale factor for the coarse search; 1.0 searches the full resolution image.
+    :return: A tuple (found, corners); corners is None when the board was not found.
+    """
+    found, corners = find_coarse_corners(gray, pattern_size, scale)
+    if not found:
+        return False, None
+    return True, refine_corners(gray, corners)
 
-    # Iterate over the images and find chessboard corners
-    for img_path in images:
-        img = cv2.imread(img_path)
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+def find_coarse_corners(gray, pattern_size, scale=1.0):
+    """
+    The search stage of find_chessboard_corners, locating the corners to about a pixel.
+    
+    :param gray: The grayscale image.
+    :param pattern_size: The number of inner corners on the chessboard (width, height).
+    :param scale: The downscale factor for the coarse search; 1.0 searches the full resolution image.
+    :return: A tuple (found, corners) with the corners in full resolution pixels; corners is None when the
+             board was not found.
+    """
+    if scale < 1.0:
+        small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        ret, corners = cv2.findChessboardCorners(small, pattern_size, COARSE_DETECTION_FLAGS)
+        if not ret:
+            return False, None
+        # Map the pixel centers of the downscaled image back to the full resolution image
+        corners = (corners + 0.5) / scale - 0.5
+    else:
         ret, corners = cv2.findChessboardCorners(gray, pattern_size, None)
+        if not ret:
+            return False, None
+    return True, corners
 
-        # If found, refine the corner positions and store the points
-        if ret:
-            criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 100, 0.0001)
-            corners2 = cv2.cornerSubPix(gray, corners, (11, 11), (-1, -1), criteria)
-            objpoints.append(objp)
-            imgpoints.append(corners2)
+def refine_corners(gray, corners):
+    """
+    The refinement stage of find_chessboard_corners, moving the corners to subpixel accuracy.
+    
+    :param gray: The full resolution grayscale image.
+    :param corners: The corners found by find_coarse_corners.
+    :return: The refined corners.
+    """
+    return cv2.cornerSubPix(gray, corners, (11, 11), (-1, -1), SUBPIX_CRITERIA)
 
-    # Calibrate the camera and return the results
-    ret, mtx, dist, rvecs, tvecs = cv2.calibrateCamera(objpoints, imgpoints, gray.shape[::-1], None, None)
+class PatternDetector(abc.ABC):
+    """
+    Interface of the calibration target detectors. A detector knows the layout of its target and finds
+    its points in a grayscale image; the calibration only sees the points and their object coordinates.
+    Detectors hold plain parameters and build their OpenCV objects on first use, so they can be sent
+    to worker processes.
+    """
+
+    name = None
+
+    def __init__(self, pattern_size):
+        """
+        :param pattern_size: The number of points of the target (width, height).
+        """
+        self.pattern_size = tuple(pattern_size)
+
+    def key(self):
+        """
+        :return: A hashable description of the target and the detection settings; detectors with equal
+                 keys find the same points.
+        """
+        return self.name, self.pattern_size
+
+    def object_points(self, square_size):
+        """
+        :param square_size: The size of the target's unit, see the detector.
+        :return: An (N, 3) float32 array of the coordinates of all points of the target, in id order.
+        """
+        return chessboard_object_points(square_size, self.pattern_size)
+
+    @abc.abstractmethod
+    def detect(self, gray, scale=1.0):
+        """
+        Finds the target's points in a grayscale image.
+        :param gray: The grayscale image.
+        :param scale: The downscale factor for a coarse search, for detectors that support one.
+        :return: A tuple (corners, ids): the (N, 1, 2) float32 points, and their indices in object_points or
+                 None if all points were found in order. corners is None when the target was not found.
+        """
+
+    def __eq__(self, other):
+        return isinstance(other, PatternDetector) and self.key() == other.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def __repr__(self):
+        return f"{type(self).__name__}{self.key()[1:]}"
+
+    def __getstate__(self):
+        # OpenCV objects cannot be pickled, the receiving process builds its own
+        return {name: value for name, value in self.__dict__.items() if not name.startswith("_")}
+
+class ChessboardDetector(PatternDetector):
+    """
+    Chessboard with pattern_size inner corners, found with find_chessboard_corners. The unit is the square size.
+    The whole board must be visible.
+    """
+
+    name = "CHESSBOARD"
+
+    def key(self):
+        return self.name, self.pattern_size, COARSE_DETECTION_FLAGS, SUBPIX_CRITERIA
+
+    def detect(self, gray, scale=1.0):
+        found, corners = find_chessboard_corners(gray, self.pattern_size, scale)
+        return corners, None
+
+class CharucoDetector(PatternDetector):
+    """
+    ChArUco board with pattern_size inner corners, that is one square more per side. The unit is the square size.
+    The ArUco markers identify every corner, so partly occluded or cropped boards still give a detection
+    of the visible corners. The coarse search scale is not used; the marker search is fast at full resolution.
+    """
+
+    name = "CHARUCO"
+
+    def __init__(self, pattern_size, marker_ratio=0.75, dictionary="DICT_5X5_100"):
+        """
+        :param pattern_size: The number of inner corners of the board (width, height).
+        :param marker_ratio: The side of a marker relative to the side of a square.
+        :param dictionary: The name of the predefined ArUco dictionary of the markers, e.g. DICT_5X5_100.
+        """
+        super().__init__(pattern_size)
+        if not dictionary.startswith("DICT_") or not hasattr(cv2.aruco, dictionary):
+            raise ValueError(f"unknown ArUco dictionary {dictionary}")
+        self.marker_ratio = float(marker_ratio)
+        if not 0 < self.marker_ratio < 1:
+            raise ValueError("the marker ratio must be between 0 and 1")
+        self.dictionary = dictionary
+
+    def key(self):
+        return self.name, self.pattern_size, self.marker_ratio, self.dictionary
+
+    def detect(self, gray, scale=1.0):
+        if getattr(self, "_detector", None) is None:
+            board = cv2.aruco.CharucoBoard((self.pattern_size[0] + 1, self.pattern_size[1] + 1), 1.0,
+                                           self.marker_ratio,
+                                           cv2.aruco.getPredefinedDictionary(getattr(cv2.aruco, self.dictionary)))
+            self._detector = cv2.aruco.CharucoDetector(board)
+        corners, ids, _, _ = self._detector.detectBoard(gray)
+        if ids is None or len(ids) < MIN_PARTIAL_CORNERS:
+            return None, None
+        ids = ids.reshape(-1).astype(np.int32)
+        # Corners along a single line do not constrain the board pose
+        grid = np.stack([ids % self.pattern_size[0], ids // self.pattern_size[0]], axis=1)
+        if np.linalg.matrix_rank(grid - grid.mean(axis=0)) < 2:
+            return None, None
+        return corners.reshape(-1, 1, 2).astype(np.float32), ids
+
+class CirclesGridDetector(PatternDetector):
+    """
+    Symmetric grid of pattern_size dark circles on a light background, found with cv2.findCirclesGrid.
+    The unit is the distance between neighbouring circle centers. The whole grid must be visible.
+    With a scale below 1 the circles are searched in the downscaled image, without a refinement step.
+    """
+
+    name = "CIRCLES_GRID"
+    flags = cv2.CALIB_CB_SYMMETRIC_GRID
+
+    def detect(self, gray, scale=1.0):
+        # Blob centers are centroids of whole circles, so a downscaled search keeps their accuracy
+        if scale < 1.0:
+            gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        # The default blob size limit misses the circles of high resolution images
+        params = cv2.SimpleBlobDetector_Params()
+        params.maxArea = gray.shape[0] * gray.shape[1] / (self.pattern_size[0] * self.pattern_size[1])
+        found, centers = cv2.findCirclesGrid(gray, self.pattern_size, flags=self.flags,
+                                             blobDetector=cv2.SimpleBlobDetector_create(params))
+        if not found:
+            return None, None
+        if scale < 1.0:
+            centers = (centers + 0.5) / scale - 0.5
+        return centers.reshape(-1, 1, 2).astype(np.float32), None
+
+class AsymmetricCirclesGridDetector(CirclesGridDetector):
+    """
+    Asymmetric grid of dark circles, pattern_size[0] circles per row and pattern_size[1] rows, every other row
+    shifted by half the circle distance. The unit is the distance between rows, half the distance between the
+    circles of a row. The number of rows must be odd; cv2.findCirclesGrid orders the circles of grids with an
+    even number of rows inconsistently.
+    """
+
+    name = "ASYMMETRIC_CIRCLES_GRID"
+    flags = cv2.CALIB_CB_ASYMMETRIC_GRID
+
+    def __init__(self, pattern_size):
+        """
+        :param pattern_size: The number of circles per row and the number of rows (width, height).
+        """
+        super().__init__(pattern_size)
+        if self.pattern_size[1] % 2 == 0:
+            raise ValueError("asymmetric circle grids need an odd number of rows")
+
+    def object_points(self, square_size):
+        columns, rows = np.meshgrid(np.arange(self.pattern_size[0]), np.arange(self.pattern_size[1]))
+        objp = np.zeros((self.pattern_size[0] * self.pattern_size[1], 3), np.float32)
+        objp[:, 0] = ((2 * columns + rows % 2) * square_size).ravel()
+        objp[:, 1] = (rows * square_size).ravel()
+        return objp
+
+# Detector classes by the pattern type names used in the server protocol
+PATTERN_DETECTORS = {detector.name: detector for detector in (ChessboardDetector, CharucoDetector,
+                                                              CirclesGridDetector, AsymmetricCirclesGridDetector)}
+
+def pattern_detector(pattern):
+    """
+    :param pattern: A PatternDetector, or the number of inner corners (width, height) of a chessboard.
+    :return: The PatternDetector of the pattern.
+    """
+    return pattern if isinstance(pattern, PatternDetector) else ChessboardDetector(pattern)
+
+def load_gray(image):
+    """
+    Get the grayscale version of an image.
+    
+    :param image: The path of an image file, or an already decoded BGR or grayscale image.
+    :return: The grayscale image.
+    """
+    if isinstance(image, np.ndarray):
+        return image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    img = cv2.imread(image)
+    return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+def detect_image(image, pattern, scale=1.0):
+    """
+    Detect the calibration target in an image.
+    
+    :param image: The path of the image file, or an image held in memory.
+    :param pattern: A PatternDetector, or the number of inner corners (width, height) of a chessboard.
+    :param scale: The downscale factor for the coarse search, see find_chessboard_corners.
+    :return: A Detection for the image; the target counts as not found if OpenCV rejects the image,
+             e.g. one too small for the detector.
+    """
+    gray = load_gray(image)
+    try:
+        corners, ids = pattern_detector(pattern).detect(gray, scale)
+    except cv2.error as e:
+        logger.warning("Target detection failed on a %dx%d image: %s", gray.shape[1], gray.shape[0], e.err)
+        return Detection(False, None, gray.shape[::-1])
+    return Detection(corners is not None, corners, gray.shape[::-1], ids)
+
+def _init_detection_worker():
+    """
+    Keep each detection process single-threaded so the pool does not oversubscribe the cores.
+    """
+    cv2.setNumThreads(1)
+
+def detect_images(images, pattern, workers=1, scale=1.0):
+    """
+    Detect the calibration target in every image of a set.
+    
+    :param images: The list of image paths or images held in memory (e.g. from a FrameStore).
+    :param pattern: A PatternDetector, or the number of inner corners (width, height) of a chessboard.
+    :param workers: The number of detection processes; 1 detects serially in this process,
+                    None uses one process per core.
+    :param scale: The downscale factor for the coarse search, see find_chessboard_corners.
+    :return: A list of Detection, one per image in the same order.
+    """
+    if workers == 1 or len(images) <= 1:
+        return [detect_image(image, pattern, scale) for image in images]
+
+    # Fan the images out over a process pool; map() keeps the results in input order
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_detection_worker) as pool:
+        return list(pool.map(detect_image, images, repeat(pattern), repeat(scale)))
+
+def calibrate_from_points(objpoints, imgpoints, image_size, prefix, output_dir=".", max_view_error=None,
+                          view_indices=None, corner_ids=None):
+    """
+    Solve the camera intrinsics from already detected points and save the results.
+    
+    With a max_view_error, the views whose RMS reprojection error exceeds it are dropped, worst first
+    and at most a tenth of the views per round, and the intrinsics are solved again starting from the
+    previous solution, for up to MAX_REJECTION_ROUNDS rounds.
     
-    np.savez(f"{prefix.lower()}_calibration_data.npz",
+    :param objpoints: The list of 3D object points, one array per view.
+    :param imgpoints: The list of detected 2D image points, one array per view.
+    :param image_size: The image size as (width, height).
+    :param prefix: The camera prefix used to name the output file.
+    :param output_dir: The directory the results are saved to.
+    :param max_view_error: The largest accepted RMS reprojection error of a view in pixels; None keeps all views.
+    :param view_indices: The index of each view in the caller's input, defaults to 0..N-1.
+    :param corner_ids: The index of each point of each view in the target, for partial detections; None when
+                       every view holds all points of the target in order.
+    :return: A CameraCalibration.
+    """
+    keep = np.ones(len(objpoints), bool)
+    # Views with fewer points than the longest one have NaN errors past their last point
+    corner_errors = np.full((len(objpoints), max(len(points) for points in objpoints)), np.nan)
+    view_errors = np.zeros(len(objpoints))
+    rotation_vectors = np.zeros((len(objpoints), 3, 1))
+    translation_vectors = np.zeros((len(objpoints), 3, 1))
+
+    ret, mtx, dist, rvecs, tvecs = cv2.calibrateCamera(objpoints, imgpoints, image_size, None, None)
+    corner_errors[keep], view_errors[keep] = reprojection_errors(objpoints, imgpoints, rvecs, tvecs, mtx, dist)
+    rotation_vectors[keep], translation_vectors[keep] = rvecs, tvecs
+
+    for _ in range(MAX_REJECTION_ROUNDS if max_view_error is not None else 0):
+        kept = np.flatnonzero(keep)
+        outliers = kept[view_errors[kept] > max_view_error]
+        # One bad view also raises the errors of the others, so only the worst ones go in each round
+        count = min(len(outliers), max(1, len(kept) // 10), len(kept) - MIN_CALIBRATION_VIEWS)
+        if count <= 0:
+            break
+        keep[outliers[np.argsort(view_errors[outliers])[::-1][:count]]] = False
+        logger.info("Re-solving %s without %d view(s) above %s px...", prefix, count, max_view_error)
+
+        kept_objpoints = [objpoints[i] for i in np.flatnonzero(keep)]
+        kept_imgpoints = [imgpoints[i] for i in np.flatnonzero(keep)]
+        ret, mtx, dist, rvecs, tvecs = cv2.calibrateCamera(kept_objpoints, kept_imgpoints, image_size, mtx, dist,
+                                                           flags=cv2.CALIB_USE_INTRINSIC_GUESS)
+        # Rejected views keep the errors and poses of the last solve they were part of
+        kept_errors, view_errors[keep] = reprojection_errors(kept_objpoints, kept_imgpoints, rvecs, tvecs, mtx, dist)
+        corner_errors[keep, :kept_errors.shape[1]] = kept_errors
+        rotation_vectors[keep], translation_vectors[keep] = rvecs, tvecs
+
+    view_indices = np.arange(len(objpoints)) if view_indices is None else np.asarray(view_indices)
+    partial = {}
+    if corner_ids is not None:
+        partial["corner_ids"] = np.full(corner_errors.shape, -1)
+        for view, ids in zip(partial["corner_ids"], corner_ids):
+            view[:len(ids)] = ids
+    np.savez(os.path.join(output_dir, f"{prefix.lower()}_calibration_data.npz"),
              camera_matrix=mtx,
              distortion_coefficients=dist,
-             rotation_vectors=rvecs,
-             translation_vectors=tvecs)
+             rotation_vectors=rotation_vectors, # Board rotation of each view, from its last solve like its errors.
+             translation_vectors=translation_vectors,   # Board translation of each view, likewise.
+             rms_error=ret,
+             view_indices=view_indices,         # Index of each view in the input.
+             view_errors=view_errors,           # RMS reprojection error of each view in pixels.
+             corner_errors=corner_errors,       # Reprojection error of each corner of each view in pixels.
+             rejected_views=~keep,              # Views left out of the final solve as outliers.
+             **partial)                         # Target index of each corner in corner_errors, -1 past the end.
+
+    logger.info("Single calibration of %s complete, RMS error %.4f px.", prefix, ret)
+    return CameraCalibration(ret, mtx, dist, view_indices, view_errors, ~keep)
+
+def detection_points(detection, objp):
+    """
+    :param detection: A Detection where the target was found.
+    :param objp: The object points of the whole target.
+    :return: The object points of the detected corners.
+    """
+    return objp if detection.ids is None else objp[detection.ids]
 
-    print(f"Single calibration complete.")
-    return ret, mtx, dist
+def calibration_from_detections(detections, square_size, pattern, prefix, output_dir=".",
+                                max_view_error=None):
+    """
+    Perform calibration for a single camera from corners that were detected ahead of time.
+    
+    :param detections: A list of Detection, one per image.
+    :param square_size: The size of the target's unit, e.g. one square on the chessboard.
+    :param pattern: A PatternDetector, or the number of inner corners (width, height) of a chessboard.
+    :param prefix: The camera prefix used to name the output file.
+    :param output_dir: The directory the results are saved to.
+    :param max_view_error: The largest accepted RMS reprojection error of a view, see calibrate_from_points.
+    :return: A CameraCalibration whose view indices refer to the detections.
+    """
+    # Prepare object points based on the target's layout and size
+    objp = pattern_detector(pattern).object_points(square_size)
 
-def send_calibration_complete_signal():
+    # Arrays to store object points and image points
+    objpoints = []  # 3d points in real world space
+    imgpoints = []  # 2d points in image plane
+    view_indices = []
+    corner_ids = []
+    image_size = None
+
+    # Keep only the images where the board was found
+    for index, detection in enumerate(detections):
+        if detection.found:
+            objpoints.append(detection_points(detection, objp))
+            imgpoints.append(detection.corners)
+            view_indices.append(index)
+            corner_ids.append(detection.ids)
+            image_size = detection.image_size
+    if not objpoints:
+        raise ValueError(f"No {prefix} image with a detected calibration target to calibrate from.")
+
+    # Calibrate the camera and return the results
+    if all(ids is None for ids in corner_ids):
+        corner_ids = None
+    return calibrate_from_points(objpoints, imgpoints, image_size, prefix, output_dir, max_view_error, view_indices,
+                                 corner_ids)
+
+def camera_calibration(images, square_size, pattern, prefix, detections=None, workers=1, scale=1.0,
+                       output_dir=".", max_view_error=None):
     """
-    Send a signal indicating the calibration process is complete.
+    Perform calibration for a single camera using images of a calibration target.
+    
+    :param images: The list of image paths or images held in memory used for calibration.
+    :param square_size: The size of the target's unit, e.g. one square on the chessboard.
+    :param pattern: A PatternDetector, or the number of inner corners (width, height) of a chessboard.
+    :param prefix: The camera prefix used to name the output file.
+    :param detections: Precomputed Detection list for the images; the images are only read when omitted.
+    :param workers: The number of detection processes, see detect_images.
+    :param scale: The downscale factor for the coarse detection search, see find_chessboard_corners.
+    :param output_dir: The directory the results are saved to.
+    :param max_view_error: The largest accepted RMS reprojection error of a view, see calibrate_from_points.
+    :return: A CameraCalibration.
     """
-    attempts = 3
-    for _ in range(attempts):
-        try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.connect(('127.0.0.1', 12346))
-                s.sendall(b'Calibration Complete')
-                break
-        except ConnectionRefusedError:
-            time.sleep(1)
+    if detections is None:
+        detections = detect_images(images, pattern, workers, scale)
+    return calibration_from_detections(detections, square_size, pattern, prefix, output_dir, max_view_error)
 
 def main():
     """
@@ -86,11 +497,14 @@ def main():
     image_num = 20
     square_size = 0.035
     pattern_size = (7, 10)
+    detection_workers = os.cpu_count()
+    detection_scale = 1.0   # Downscale factor for the coarse corner search, e.g. 0.5 for 1080p and above
+    max_view_error = None   # Drop views with a larger RMS reprojection error in pixels, e.g. 1.0
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
 
     image_files = find_image_files("LEFT", "LEFT", image_num)
-    camera_calibration(image_files, square_size, pattern_size, "LEFT")
-
-    send_calibration_complete_signal()
+    camera_calibration(image_files, square_size, pattern_size, "LEFT",
+                       workers=detection_workers, scale=detection_scale, max_view_error=max_view_error)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,161 @@
+import asyncio
+
+DEFAULT_BUFFER_SIZE = 64 * 1024   # Size of the reusable receive buffer
+MAX_LINE_LENGTH = 1024            # Longest header line accepted before the stream is considered broken
+
+class _FrameBuffer:
+    """
+    Socket-independent part of the readers: one preallocated receive buffer from which header
+    lines are cut, with the bytes following them kept for the next read.
+    """
+
+    def __init__(self, connection, buffer_size):
+        self.connection = connection
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        self._start = 0     # First unread byte in the buffer
+        self._end = 0       # End of the received data in the buffer
+
+    def buffered(self):
+        """
+        :return: The number of received bytes that have not been read yet.
+        """
+        return self._end - self._start
+
+    def _take_line(self, max_length):
+        """
+        Cuts the next complete line out of the buffer.
+        :return: The line without its newline, or None if no complete line is buffered yet.
+        """
+        newline = self._buffer.find(b'\n', self._start, self._end)
+        if newline >= 0:
+            line = bytes(self._view[self._start:newline])
+            self._start = newline + 1
+            return line
+        if self._end - self._start >= max_length:
+            raise ValueError(f"Header line longer than {max_length} bytes.")
+        return None
+
+    def _free_space(self):
+        """
+        Makes room at the end of the buffer, moving the unread bytes to the front if needed.
+        :return: A writable memoryview of the free space.
+        """
+        if self._start == self._end:
+            self._start = self._end = 0
+        elif self._end == len(self._buffer):
+            pending = self._end - self._start
+            self._view[:pending] = self._view[self._start:self._end]
+            self._start, self._end = 0, pending
+        return self._view[self._end:]
+
+    def _take_buffered(self, view):
+        """
+        Copies buffered payload bytes into view.
+        :return: The number of bytes copied.
+        """
+        count = min(self._end - self._start, len(view))
+        view[:count] = self._view[self._start:self._start + count]
+        self._start += count
+        return count
+
+class FrameReader(_FrameBuffer):
+    """
+    Buffered reader for the newline-terminated header + raw payload protocol on a blocking socket.
+
+    Socket data is received with recv_into into one preallocated buffer. Header lines are
+    cut out of that buffer and any bytes following them stay buffered for the next read, so
+    a header costs one recv instead of one recv per byte. Payloads are received straight
+    into the caller's destination buffer once the leftover bytes have been handed over.
+    """
+
+    def __init__(self, connection, buffer_size=DEFAULT_BUFFER_SIZE):
+        """
+        :param connection: The socket connection to read from.
+        :param buffer_size: Size of the reusable receive buffer in bytes.
+        """
+        super().__init__(connection, buffer_size)
+
+    def read_line(self, max_length=MAX_LINE_LENGTH):
+        """
+        Reads one newline-terminated line, keeping the bytes after it for the next read.
+        Socket timeouts are propagated; the partial line stays buffered, so the call can be retried.
+        :param max_length: The longest line accepted.
+        :return: The line without its newline, or None if the connection was closed.
+        """
+        line = self._take_line(max_length)
+        while line is None:
+            received = self.connection.recv_into(self._free_space())
+            if not received:
+                return None
+            self._end += received
+            line = self._take_line(max_length)
+        return line
+
+    def recv_into(self, view):
+        """
+        Receives up to len(view) payload bytes into view, serving buffered bytes first and
+        then receiving directly from the socket without an intermediate copy.
+        :param view: A writable memoryview to fill.
+        :return: The number of bytes written, 0 when the connection was closed.
+        """
+        if self.buffered():
+            return self._take_buffered(view)
+        return self.connection.recv_into(view)
+
+class AsyncFrameReader(_FrameBuffer):
+    """
+    asyncio counterpart of FrameReader for a non-blocking socket, using the event loop's sock_recv_into.
+    """
+
+    def __init__(self, connection, buffer_size=DEFAULT_BUFFER_SIZE):
+        """
+        :param connection: The non-blocking socket connection to read from.
+        :param buffer_size: Size of the reusable receive buffer in bytes.
+        """
+        super().__init__(connection, buffer_size)
+        self._loop = asyncio.get_running_loop()
+
+    async def read_line(self, max_length=MAX_LINE_LENGTH):
+        """
+        Reads one newline-terminated line, keeping the bytes after it for the next read.
+        :param max_length: The longest line accepted.
+        :return: The line without its newline, or None if the connection was closed.
+        """
+        line = self._take_line(max_length)
+        while line is None:
+            received = await self._loop.sock_recv_into(self.connection, self._free_space())
+            if not received:
+                return None
+            self._end += received
+            line = self._take_line(max_length)
+        return line
+
+    async def recv_into(self, view):
+        """
+        Receives up to len(view) payload bytes into view, serving buffered bytes first.
+        :param view: A writable memoryview to fill.
+        :return: The number of bytes written, 0 when the connection was closed.
+        """
+        if self.buffered():
+            return self._take_buffered(view)
+        return await self._loop.sock_recv_into(self.connection, view)
+
+    async def read_exact(self, length):
+        """
+        Receives a payload of the given length directly into a buffer of its final size.
+        :param length: The payload length in bytes.
+        :return: The payload as a bytearray, shorter than length if the connection was closed.
+        """
+        buffer = bytearray(length)
+        view = memoryview(buffer)
+        received = 0
+        while received < length:
+            count = await self.recv_into(view[received:])
+            if not count:
+                break
+            received += count
+        view.release()
+        if received < length:
+            del buffer[received:]
+        return buffer
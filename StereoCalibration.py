@@ -1,10 +1,13 @@
+import logging
 import os
 import cv2
 import numpy as np
-import socket
-import time
 
-from SingleCalibration import camera_calibration
+from RectificationMaps import compute_rectification_maps, save_rectification_maps
+from SingleCalibration import (MIN_PARTIAL_CORNERS, SUBPIX_CRITERIA, camera_calibration, detect_images,
+                               pattern_detector)
+
+logger = logging.getLogger(__name__)
 
 def find_image_files(base_path, prefix, count):
     """
@@ -21,66 +24,125 @@ def find_image_files(base_path, prefix, count):
         if os.path.exists(filename):
             image_files.append(filename)
         else:
-            print(f"Missing image file: {filename}")
+            logger.warning("Missing image file: %s", filename)
             break
     return image_files
 
-def stereo_calibration(left_images, right_images, square_size, pattern_size):
+def common_corners(left, right):
+    """
+    Matches the corners of a stereo pair detected in both images.
+    :param left: The left Detection, the target was found.
+    :param right: The right Detection, the target was found.
+    :return: A tuple (ids, left_corners, right_corners) of the corners found in both images; ids is None
+             when both images hold all corners in order.
+    """
+    if left.ids is None and right.ids is None:
+        return None, left.corners, right.corners
+    left_ids = np.arange(len(left.corners)) if left.ids is None else left.ids
+    right_ids = np.arange(len(right.corners)) if right.ids is None else right.ids
+    ids, left_index, right_index = np.intersect1d(left_ids, right_ids, assume_unique=True, return_indices=True)
+    return ids, left.corners[left_index], right.corners[right_index]
+
+def stereo_calibration(left_images, right_images, square_size, pattern, workers=1, scale=1.0,
+                       output_dir=".", max_view_error=None):
     """
     Perform stereo camera calibration given the image sets from both cameras.
     
-    :param left_images: Image paths for the left camera.
-    :param right_images: Image paths for the right camera.
-    :param square_size: Size of the chessboard square.
-    :param pattern_size: Chessboard pattern (width, height).
-    :return: None
+    :param left_images: Image paths or images held in memory for the left camera.
+    :param right_images: Image paths or images held in memory for the right camera.
+    :param square_size: Size of the target's unit, e.g. the chessboard square.
+    :param pattern: A PatternDetector, or the chessboard pattern (width, height).
+    :param workers: The number of detection processes, see detect_images.
+    :param scale: The downscale factor for the coarse detection search, see find_chessboard_corners.
+    :param output_dir: The directory the results are saved to.
+    :param max_view_error: The largest accepted RMS reprojection error of a view, see calibrate_from_points.
+    :return: The stereo RMS re-projection error.
     """
+    # Detect the corners of both cameras in one pass; the intrinsic and stereo stages share the results
+    detections = detect_images(list(left_images) + list(right_images), pattern, workers, scale)
+    left_detections = detections[:len(left_images)]
+    right_detections = detections[len(left_images):]
 
+    return stereo_calibration_from_detections(left_detections, right_detections, square_size, pattern,
+                                              output_dir, max_view_error)
+
+def stereo_calibration_from_detections(left_detections, right_detections, square_size, pattern,
+                                       output_dir=".", max_view_error=None):
+    """
+    Perform stereo camera calibration from corners that were detected ahead of time. With partial
+    detections, each pair contributes the corners found in both of its images.
+    
+    :param left_detections: Detection list for the left camera.
+    :param right_detections: Detection list for the right camera, in the same order.
+    :param square_size: Size of the target's unit, e.g. the chessboard square.
+    :param pattern: A PatternDetector, or the chessboard pattern (width, height).
+    :param output_dir: The directory the results are saved to.
+    :param max_view_error: The largest accepted RMS reprojection error of a view, see calibrate_from_points.
+                           Pairs with a view rejected on either camera are left out of the stereo solve.
+    :return: The stereo RMS re-projection error.
+    """
     # Calibrate the left camera
-    print("Calibrating left camera...")
-    _, mtx_left, dist_left = camera_calibration(left_images, square_size, pattern_size, "LEFT")
+    logger.info("Calibrating left camera...")
+    left = camera_calibration(None, square_size, pattern, "LEFT", left_detections, output_dir=output_dir,
+                              max_view_error=max_view_error)
+    mtx_left, dist_left = left.camera_matrix, left.distortion_coefficients
 
     # Calibrate the right camera
-    print("Calibrating right camera...")
-    _, mtx_right, dist_right = camera_calibration(right_images, square_size, pattern_size, "RIGHT")
+    logger.info("Calibrating right camera...")
+    right = camera_calibration(None, square_size, pattern, "RIGHT", right_detections, output_dir=output_dir,
+                               max_view_error=max_view_error)
+    mtx_right, dist_right = right.camera_matrix, right.distortion_coefficients
+
+    rejected = set(left.view_indices[left.rejected_views]) | set(right.view_indices[right.rejected_views])
 
     # Prepare object points similar to the single camera calibration
-    objp = np.zeros((pattern_size[0] * pattern_size[1], 3), np.float32)
-    objp[:, :2] = np.mgrid[0:pattern_size[0], 0:pattern_size[1]].T.reshape(-1, 2) * square_size
+    objp = pattern_detector(pattern).object_points(square_size)
 
     # Arrays to store object points and image points from both cameras
     objpoints = []
     imgpoints_left = []
     imgpoints_right = []
-
-    # Iterate through pairs of images
-    for img_left_path, img_right_path in zip(left_images, right_images):
-        img_left = cv2.imread(img_left_path)
-        img_right = cv2.imread(img_right_path)
-
-        # Convert to grayscale
-        gray_left = cv2.cvtColor(img_left, cv2.COLOR_BGR2GRAY)
-        gray_right = cv2.cvtColor(img_right, cv2.COLOR_BGR2GRAY)
-
-        # Find the chessboard corners for both images
-        ret_left, corners_left = cv2.findChessboardCorners(gray_left, pattern_size, None)
-        ret_right, corners_right = cv2.findChessboardCorners(gray_right, pattern_size, None)
-
-        # If corners are found in both images, refine and store them
-        if ret_left and ret_right:
-            criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 100, 0.0001)
-            corners2_left = cv2.cornerSubPix(gray_left, corners_left, (11, 11), (-1, -1), criteria)
-            corners2_right = cv2.cornerSubPix(gray_right, corners_right, (11, 11), (-1, -1), criteria)
-            objpoints.append(objp)
-            imgpoints_left.append(corners2_left)
-            imgpoints_right.append(corners2_right)
-
+    image_size = None
+
+    # If corners are found in both images of a pair and neither is an outlier, store them
+    for index, (left, right) in enumerate(zip(left_detections, right_detections)):
+        if left.found and right.found and index not in rejected:
+            ids, left_corners, right_corners = common_corners(left, right)
+            if ids is not None and len(ids) < MIN_PARTIAL_CORNERS:
+                continue
+            objpoints.append(objp if ids is None else objp[ids])
+            imgpoints_left.append(left_corners)
+            imgpoints_right.append(right_corners)
+            image_size = left.image_size
+    if not objpoints:
+        raise ValueError("No stereo pair with the calibration target detected in both images to calibrate from.")
+
+    return stereo_calibrate_from_points(objpoints, imgpoints_left, imgpoints_right,
+                                        mtx_left, dist_left, mtx_right, dist_right, image_size, output_dir)
+
+def stereo_calibrate_from_points(objpoints, imgpoints_left, imgpoints_right,
+                                 mtx_left, dist_left, mtx_right, dist_right, image_size, output_dir="."):
+    """
+    Solve the stereo extrinsics from already detected points and save the results, together with
+    the rectification maps of the pair (see RectificationMaps.py).
+    
+    :param objpoints: The list of 3D object points, one array per stereo pair.
+    :param imgpoints_left: The detected left image points, one array per stereo pair.
+    :param imgpoints_right: The detected right image points, one array per stereo pair.
+    :param mtx_left: The left camera matrix.
+    :param dist_left: The left distortion coefficients.
+    :param mtx_right: The right camera matrix.
+    :param dist_right: The right distortion coefficients.
+    :param image_size: The image size as (width, height).
+    :param output_dir: The directory the results are saved to.
+    :return: The stereo RMS re-projection error.
+    """
     # Perform stereo calibration
     ret, mtx_left, dist_left, mtx_right, dist_right, R, T, E, F = cv2.stereoCalibrate(
         objpoints, imgpoints_left, imgpoints_right, mtx_left, dist_left, mtx_right, dist_right,
-        gray_left.shape[::-1], criteria=criteria, flags=cv2.CALIB_FIX_INTRINSIC)
+        image_size, criteria=SUBPIX_CRITERIA, flags=cv2.CALIB_FIX_INTRINSIC)
 
-    np.savez('stereo_calibration_data.npz',
+    np.savez(os.path.join(output_dir, 'stereo_calibration_data.npz'),
         rms_error=ret,                              # The root mean square (RMS) re-projection error.
         left_camera_matrix=mtx_left,                # The camera matrix for the left camera.
         left_distortion_coefficients=dist_left,     # The distortion coefficients for the left camera.
@@ -89,24 +151,15 @@ def stereo_calibration(left_images, right_images, square_size, pattern_size):
         rotation_matrix=R,                          # The rotation matrix between the two camera coordinate systems.
         translation_vector=T,                       # The translation vector between the camera coordinate systems.
         essential_matrix=E,                         # The essential matrix.
-        fundamental_matrix=F)                       # The fundamental matrix.
-    
-    print("Stereo calibration complete.")
+        fundamental_matrix=F,                       # The fundamental matrix.
+        image_size=np.array(image_size))            # The image size (width, height) the calibration applies to.
 
+    # Compute the remap tables once here instead of in every consumer of the calibration
+    save_rectification_maps(compute_rectification_maps(mtx_left, dist_left, mtx_right, dist_right, R, T, image_size),
+                            output_dir)
 
-def send_calibration_complete_signal():
-    """
-    Send a signal indicating the calibration process is complete.
-    """
-    attempts = 3
-    for _ in range(attempts):
-        try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.connect(('127.0.0.1', 12346))
-                s.sendall(b'Calibration Complete')
-                break
-        except ConnectionRefusedError:
-            time.sleep(1)
+    logger.info("Stereo calibration complete, RMS error %.4f px.", ret)
+    return ret
 
 def main():
     """
@@ -116,6 +169,10 @@ def main():
     image_num = 20
     square_size = 0.035
     pattern_size = (7, 10)
+    detection_workers = os.cpu_count()
+    detection_scale = 1.0   # Downscale factor for the coarse corner search, e.g. 0.5 for 1080p and above
+    max_view_error = None   # Drop views with a larger RMS reprojection error in pixels, e.g. 1.0
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
 
     # Find the image paths for left and right cameras
     left_images = find_image_files("LEFT", "LEFT", image_num)
@@ -124,12 +181,12 @@ def main():
     # Calibrate each camera and then perform stereo calibration
     if len(left_images) == image_num and len(right_images) == image_num:
 
-        print("Performing stereo calibration...")
-        stereo_calibration(left_images, right_images, square_size, pattern_size)
-
-        send_calibration_complete_signal()
+        logger.info("Performing stereo calibration...")
+        stereo_calibration(left_images, right_images, square_size, pattern_size,
+                           detection_workers, detection_scale, max_view_error=max_view_error)
     else:
-        print("Not enough images for calibration. Found left: {}, right: {}.".format(len(left_images), len(right_images)))
+        logger.error("Not enough images for calibration. Found left: %d, right: %d.",
+                     len(left_images), len(right_images))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
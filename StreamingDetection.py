@@ -0,0 +1,147 @@
+import zlib
+import cv2
+import numpy as np
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from SingleCalibration import detect_image
+
+# Image payload formats understood by decode_image
+PAYLOAD_FORMATS = ("PNG", "GRAY8", "ZGRAY8")
+
+def decode_image(image_data, payload_format="PNG", size=None):
+    """
+    Turns a received image payload into a grayscale frame.
+    Raw GRAY8 payloads are wrapped as a NumPy array without copying; ZGRAY8 payloads are
+    zlib-compressed GRAY8, inflated to at most one frame; any other format is decoded with cv2.imdecode.
+    :param image_data: The payload bytes.
+    :param payload_format: The payload format, one of PAYLOAD_FORMATS.
+    :param size: The frame size as (width, height), required for the GRAY8 formats.
+    :return: The grayscale frame, or None if the payload could not be decoded.
+    """
+    if payload_format in ("GRAY8", "ZGRAY8"):
+        width, height = size
+        if width <= 0 or height <= 0:
+            return None
+        if payload_format == "ZGRAY8":
+            # A payload inflating beyond the declared frame size is rejected without inflating it completely
+            decompressor = zlib.decompressobj()
+            try:
+                image_data = decompressor.decompress(image_data, width * height + 1)
+            except zlib.error:
+                return None
+            if decompressor.unconsumed_tail:
+                return None
+        if len(image_data) != width * height:
+            return None
+        return np.frombuffer(image_data, np.uint8).reshape(height, width)
+    img = cv2.imdecode(np.frombuffer(image_data, np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        return None
+    return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+def encode_image(frame, payload_format="PNG"):
+    """
+    Turns a grayscale frame into a payload, the inverse of decode_image.
+    :param frame: The grayscale frame.
+    :param payload_format: The payload format, one of PAYLOAD_FORMATS.
+    :return: The payload as a bytes-like object.
+    """
+    if payload_format == "GRAY8":
+        return memoryview(np.ascontiguousarray(frame)).cast('B')
+    if payload_format == "ZGRAY8":
+        return zlib.compress(np.ascontiguousarray(frame), 1)
+    ok, encoded = cv2.imencode(".png", frame)
+    if not ok:
+        raise ValueError("PNG encoding failed")
+    return encoded.tobytes()
+
+class StreamingDetector:
+    """
+    Runs calibration target detection on a background worker pool as soon as each frame arrives,
+    so that only the calibration solve is left once the last image has been received.
+    """
+
+    def __init__(self, pattern, max_workers=None, scale=1.0, executor=None, detection_time=None):
+        """
+        :param pattern: The PatternDetector, or the number of inner corners (width, height) of a chessboard.
+        :param max_workers: The number of detection threads, defaults to the executor's choice.
+        :param scale: The downscale factor for the coarse corner search.
+        :param executor: A shared executor to run the detections on; the detector then does not own it.
+        :param detection_time: A Histogram observing the seconds each detection takes, without its queueing.
+        """
+        self.pattern = pattern
+        self.scale = scale
+        self.detection_time = detection_time
+        self._owns_executor = executor is None
+        if executor is None:
+            # OpenCV releases the GIL while detecting, so threads run the detections in parallel.
+            executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="detector")
+        self._executor = executor
+        self._futures = {}
+
+    def submit(self, prefix, frame, pattern=None):
+        """
+        Queues the detection of a received frame.
+        :param prefix: The camera side the frame belongs to (LEFT, RIGHT or SINGLE).
+        :param frame: The decoded grayscale frame.
+        :param pattern: The PatternDetector to detect, defaults to the detector's pattern. It is fixed when
+                        the frame is queued, so changing the detector's pattern does not affect queued frames.
+        :return: The future of the frame's Detection.
+        """
+        future = self._executor.submit(self._detect, frame, self.pattern if pattern is None else pattern)
+        self._futures.setdefault(prefix, []).append(future)
+        return future
+
+    def _detect(self, frame, pattern):
+        """
+        Detects the calibration target in a frame on a worker thread.
+        """
+        if self.detection_time is None:
+            return detect_image(frame, pattern, self.scale)
+        with self.detection_time.time():
+            return detect_image(frame, pattern, self.scale)
+
+    def add_result(self, prefix, detection):
+        """
+        Records a frame whose Detection is already known, in place of detecting it again.
+        :param prefix: The camera side the frame belongs to (LEFT, RIGHT or SINGLE).
+        :param detection: The frame's Detection.
+        :return: A completed future of the Detection.
+        """
+        future = Future()
+        future.set_result(detection)
+        self._futures.setdefault(prefix, []).append(future)
+        return future
+
+    def take(self, count):
+        """
+        Stops tracking the oldest detections of every camera side, e.g. once they form a complete image set.
+        The detections keep running for whoever holds their futures.
+        :param count: The number of detections to take per camera side.
+        :return: The taken detection futures as {prefix: futures in arrival order}.
+        """
+        taken = {}
+        for prefix, futures in self._futures.items():
+            taken[prefix] = futures[:count]
+            del futures[:count]
+        return taken
+
+    def reset(self, cancel=True):
+        """
+        Drops all queued and finished detections before a new set of images.
+        :param cancel: Whether queued detections are cancelled; otherwise they still run for
+                       whoever holds their futures, the detector just stops tracking them.
+        """
+        if cancel:
+            for futures in self._futures.values():
+                for future in futures:
+                    future.cancel()
+        self._futures.clear()
+
+    def shutdown(self):
+        """
+        Drops the pending detections and stops the worker pool if the detector owns it.
+        """
+        self.reset()
+        if self._owns_executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
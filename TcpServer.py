@@ -1,237 +1,1140 @@
+import asyncio
+import functools
+import itertools
+import logging
+import os
+import re
 import socket
 import sys
-import select
-import subprocess
-import threading
-import json
+import time
+import uuid
+import cv2
+from concurrent.futures import Future, ThreadPoolExecutor
 
-from LoadCalibrationResults import load_camera_calibration_results, load_stereo_calibration_results
+from CalibrationCache import DROPPED_FRAME, CalibrationCache, detection_key, frame_fingerprint, result_key
+from CalibrationJobs import CalibrationJobRunner
+from CalibrationStore import CalibrationStore
+from FrameSelection import CoverageMap
+from FrameStore import FrameStore
+from Instrumentation import SIZE_BUCKETS, MetricsRegistry, configure_logging
+from LoadCalibrationResults import (CALIBRATION_ENCODINGS, load_view_errors, stereo_calibration_payload,
+                                    stored_calibration_payload)
+from RectificationService import RectificationError, RectificationService
+from SingleCalibration import PATTERN_DETECTORS, Detection
+from SocketFraming import AsyncFrameReader
+from StreamingDetection import PAYLOAD_FORMATS, StreamingDetector, decode_image
 
 # Server Configuration Parameters
 HOST = '127.0.0.1'          # Host IP
 PORT = 12345                # Port to listen on
-TIMEOUT = 5.0               # Socket timeout in seconds
-RECEPTION_TIMEOUT = 2.0     # Timeout for the reception event
-SIGNAL_PORT = 12346         # Port for sending calibration completion signal
+BACKLOG = 64                # Number of pending connections the listening socket queues
 REQUIRED_IMAGE_COUNT = 20   # Number of image pairs required for calibration
 CALIBRATION_MODE = "STEREO" # Default calibration mode
+PATTERN_TYPE = "CHESSBOARD" # Default calibration target, one of PATTERN_DETECTORS; clients can choose another
+SQUARE_SIZE = 0.035         # Size of one chessboard square (the unit of the default target)
+PATTERN_SIZE = (7, 10)      # Points of the default target (width, height), e.g. the inner chessboard corners
+DETECTION_WORKERS = None    # Number of background corner detection threads (None for the default)
+DETECTION_SCALE = 1.0       # Downscale factor for the coarse corner search (e.g. 0.5 for 1080p and above)
+CALIBRATION_WORKERS = None  # Number of calibration worker processes (None for one per core)
+SESSION_DIRECTORY = "sessions"  # Directory holding the results (and archived images) of each session
+CALIBRATION_STORE = os.path.join(SESSION_DIRECTORY, "calibrations.sqlite3")  # Results of every rig (None to disable)
+RECTIFICATION_DIRECTORY = os.path.join(SESSION_DIRECTORY, "rectification")  # Maps of each rig's latest stereo result
+FRAME_MEMORY_BUDGET = 2 * 1024 ** 3 # Bytes of decoded frames held in memory across all sessions
+MAX_PAYLOAD_BYTES = 64 * 1024 ** 2  # Largest image payload accepted; longer ones are rejected before receiving them
+MAX_FRAME_PIXELS = 7680 * 4320  # Largest frame size (width * height) a GRAY8 or ZGRAY8 header may declare
+ARCHIVE_FRAMES = False      # Also write the received images to the session directory in the background
+MAX_VIEWS_PER_BIN = 1       # Views accepted per coverage bin (board position, size and tilt) in feedback mode
+DETECTION_CACHE_SIZE = 10000    # Frame detections kept by content hash across sessions (0 to disable)
+RESULT_CACHE_SIZE = 64      # Calibration results kept by the hash of their ordered frame set (0 to disable)
+MAX_VIEW_ERROR = None       # Drop views with a larger RMS reprojection error in pixels and solve again (None keeps all)
+RECTIFICATION_WORKERS = None    # Number of threads rectifying stereo pairs for clients (None for the default)
+RECTIFICATION_PIPELINE_DEPTH = 8    # Stereo pairs of one client being rectified before its next pair is read
+FLOW_CONTROL_WINDOW = 8     # Largest number of frames a flow-controlled client may send ahead of their replies
+MAX_PENDING_DETECTIONS = 32 # Frames of one session queued for detection before the server pushes back
+LOG_LEVEL = "INFO"          # Minimum level of the logged messages (DEBUG also logs every received frame)
+METRICS_PORT = None         # Port of the local HTTP endpoint serving the metrics in text format (None to disable)
 
-def create_server_socket(host, port, timeout):
+# Rig IDs a client can choose; without one the client's host address is used
+RIG_ID_PATTERN = re.compile(r"[A-Za-z0-9._:-]{1,128}")
+
+# Histogram buckets of the RMS reprojection error in pixels
+RMS_ERROR_BUCKETS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0)
+
+logger = logging.getLogger(__name__)
+
+def create_server_socket(host, port):
     """
-    Creates a server socket that listens on the specified host and port.
+    Creates a non-blocking server socket that listens on the specified host and port.
     :param host: IP address of the host.
     :param port: Port number to listen on.
-    :param timeout: Timeout for the socket operations.
     :return: A socket object for the server.
     """
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.settimeout(timeout)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server_socket.setblocking(False)
     try:
         server_socket.bind((host, port))
-        server_socket.listen(1)
-        print(f'Server listening on port {port}')
+        server_socket.listen(BACKLOG)
+        logger.info("Server listening on port %d", port)
     except OSError as msg:
-        print(f'Bind failed. Error: {msg}')
+        logger.error("Bind failed. Error: %s", msg)
         sys.exit()
     return server_socket
 
-def receive_header(connection):
+def parse_payload_length(value):
+    """
+    :param value: A payload length field of a header.
+    :return: The payload length in bytes.
+    :raises ValueError: If the length is not a number from 0 to MAX_PAYLOAD_BYTES.
+    """
+    length = int(value)
+    if not 0 <= length <= MAX_PAYLOAD_BYTES:
+        raise ValueError(f"payload length {length} outside of 0 to {MAX_PAYLOAD_BYTES}")
+    return length
+
+def parse_frame_size(value):
+    """
+    :param value: A frame size field of a header, <WIDTH>x<HEIGHT>.
+    :return: The frame size as (width, height).
+    :raises ValueError: If the size is malformed, not positive or larger than MAX_FRAME_PIXELS. The size bounds
+                        what a ZGRAY8 payload inflates to, so it is checked before the payload is received.
+    """
+    width, height = (int(v) for v in value.split("x"))
+    if width <= 0 or height <= 0 or width * height > MAX_FRAME_PIXELS:
+        raise ValueError(f"frame size {width}x{height} outside of 1 to {MAX_FRAME_PIXELS} pixels")
+    return width, height
+
+def parse_image_header(header):
+    """
+    Parses an image header: Sending<SIDE>ImageData:<length>[:<FORMAT>:<WIDTH>x<HEIGHT>].
+    Without a format the payload is a PNG; the GRAY8 formats also carry the frame size.
+    :param header: The header line.
+    :return: A tuple (camera_side, length, payload_format, size); size is None for PNG.
+    :raises ValueError: If the header is malformed, the payload too long or the frame too large.
+    """
+    prefix, fields = header.split("ImageData:")
+    fields = fields.split(":")
+    length = parse_payload_length(fields[0])
+    payload_format = fields[1] if len(fields) > 1 else "PNG"
+    if payload_format not in PAYLOAD_FORMATS:
+        raise ValueError(f"unsupported payload format {payload_format}")
+    size = None
+    if payload_format != "PNG":
+        size = parse_frame_size(fields[2])
+    return prefix.replace("Sending", ""), length, payload_format, size
+
+def parse_rectify_header(header):
+    """
+    Parses a rectification request header: RectifyPair:<left length>:<right length>[:<FORMAT>:<WIDTH>x<HEIGHT>].
+    :param header: The header line.
+    :return: A tuple (left_length, right_length, payload_format, size); size is None for PNG.
+    :raises ValueError: If the header is malformed, a payload too long or the frame too large.
+    """
+    fields = header.split(":")[1:]
+    left_length, right_length = parse_payload_length(fields[0]), parse_payload_length(fields[1])
+    payload_format = fields[2] if len(fields) > 2 else "PNG"
+    if payload_format not in PAYLOAD_FORMATS:
+        raise ValueError(f"unsupported payload format {payload_format}")
+    size = None
+    if payload_format != "PNG":
+        size = parse_frame_size(fields[3])
+    return left_length, right_length, payload_format, size
+
+def parse_pattern_header(header):
+    """
+    Parses a calibration target selection: SetPattern:<TYPE>:<WIDTH>x<HEIGHT>:<SIZE>[:<MARKER RATIO>[:<DICTIONARY>]].
+    The marker ratio and the ArUco dictionary only apply to CHARUCO boards.
+    :param header: The header line.
+    :return: A tuple (detector, square_size) of the PatternDetector and the size of the target's unit.
+    :raises ValueError: If the header is malformed or selects an unsupported target.
+    """
+    fields = header.split(":")[1:]
+    pattern_type, size, square_size, options = fields[0], fields[1], float(fields[2]), fields[3:]
+    if pattern_type not in PATTERN_DETECTORS:
+        raise ValueError(f"unsupported pattern type {pattern_type}")
+    if options and pattern_type != "CHARUCO":
+        raise ValueError(f"{pattern_type} takes no options")
+    width, height = (int(value) for value in size.split("x"))
+    if width < 2 or height < 2 or not square_size > 0:
+        raise ValueError(f"invalid pattern geometry {size}:{square_size}")
+    return PATTERN_DETECTORS[pattern_type]((width, height), *options), square_size
+
+def write_file(filename, data):
+    """
+    Writes data to a file, creating its directory if needed.
+    :param filename: The path of the file.
+    :param data: The bytes to write.
+    """
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, "wb") as output_file:
+        output_file.write(data)
+
+def write_frame(filename, frame):
+    """
+    Encodes a decoded frame to an image file, creating its directory if needed.
+    :param filename: The path of the file; its extension selects the encoding.
+    :param frame: The frame to write.
+    """
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    cv2.imwrite(filename, frame)
+
+def write_payload(filename, image_data, payload_format="PNG", size=None):
+    """
+    Writes a received image payload to an image file: PNG payloads as received, the GRAY8 formats encoded to PNG.
+    :param filename: The path of the file.
+    :param image_data: The image payload.
+    :param payload_format: The payload format, one of PAYLOAD_FORMATS.
+    :param size: The frame size as (width, height) for the GRAY8 formats.
+    """
+    if payload_format == "PNG":
+        write_file(filename, image_data)
+    else:
+        write_frame(filename, decode_image(image_data, payload_format, size))
+
+def timed_call(histogram, function, *args):
+    """
+    Calls a function and observes the seconds it takes in a histogram.
+    :return: The result of the function.
+    """
+    with histogram.time():
+        return function(*args)
+
+def read_result_files(directory):
+    """
+    :param directory: The session directory a calibration was saved to.
+    :return: The saved calibration files as {filename: bytes}.
+    """
+    files = {}
+    for filename in os.listdir(directory):
+        if filename.endswith("_calibration_data.npz"):
+            with open(os.path.join(directory, filename), "rb") as result_file:
+                files[filename] = result_file.read()
+    return files
+
+def write_result_files(directory, files):
+    """
+    Restores cached calibration files into a session directory.
+    :param directory: The session directory.
+    :param files: The calibration files as {filename: bytes}.
+    """
+    for filename, data in files.items():
+        write_file(os.path.join(directory, filename), data)
+
+def latest_calibration_payload(store, rig, encoding):
     """
-    Receives the header data from the connection.
-    :param connection: The socket connection from the client.
-    :return: The header data as a string, or None if there's an issue.
+    :param store: The CalibrationStore.
+    :param rig: The rig ID.
+    :param encoding: One of CALIBRATION_ENCODINGS.
+    :return: A tuple (record, payload) of the latest stereo CalibrationRecord of the rig and its encoded
+             calibration data, or (None, None) if the rig has no stereo calibration. Both are held in
+             memory after the first request, so later requests for the rig cost two dictionary lookups.
     """
-    header_data = b''
-    while not header_data.endswith(b'\n'):
+    record = store.latest(rig)
+    if record is None:
+        return None, None
+    return record, stored_calibration_payload(record.data, encoding)
+
+class ServerMetrics:
+    """
+    The metrics of the server, shared by all sessions, in one registry: the size and receive time of
+    every frame, its decode and detection time, the detection and cache hit counts, the archival
+    write time, and the solve time and RMS error of every calibration.
+    """
+
+    def __init__(self, registry, frame_store, sessions):
+        """
+        :param registry: The MetricsRegistry to register the metrics in.
+        :param frame_store: The FrameStore whose memory use is reported.
+        :param sessions: The set of running session tasks, whose size is reported.
+        """
+        self.registry = registry
+        self.frame_bytes = registry.histogram("calibration_frame_bytes", "Payload size of the received images.",
+                                              SIZE_BUCKETS)
+        self.frame_receive_time = registry.histogram("calibration_frame_receive_seconds",
+                                                     "Time from an image header to its last payload byte.")
+        self.decode_time = registry.histogram("calibration_frame_decode_seconds",
+                                              "Decode time of the received images.")
+        self.detection_time = registry.histogram("calibration_detection_seconds",
+                                                 "Chessboard detection time, without queueing.")
+        self.detections = registry.counter("calibration_detections_total", "Images whose detection finished.")
+        self.boards_found = registry.counter("calibration_boards_found_total", "Images in which the board was found.")
+        self.detection_cache_hits = registry.counter("calibration_detection_cache_hits_total",
+                                                     "Images whose detection was reused from the cache.")
+        self.busy_frames = registry.counter("calibration_busy_frames_total",
+                                            "Images turned away for a full detection backlog or frame store.")
+        self.archive_time = registry.histogram("calibration_archive_write_seconds",
+                                               "Time to write an archived image to disk.")
+        self.solve_time = registry.histogram("calibration_solve_seconds",
+                                             "Calibration solve time, including waiting for a worker.")
+        self.rms_error = registry.histogram("calibration_rms_error_pixels",
+                                            "RMS reprojection error of the solved calibrations.", RMS_ERROR_BUCKETS)
+        self.calibrations = registry.counter("calibrations_total", "Completed calibrations.")
+        self.calibration_failures = registry.counter("calibration_failures_total", "Failed calibrations.")
+        self.result_cache_hits = registry.counter("calibration_result_cache_hits_total",
+                                                  "Calibrations answered from the result cache.")
+        registry.gauge("calibration_sessions", "Connected clients.", lambda: len(sessions))
+        registry.gauge("calibration_frame_store_bytes", "Bytes of decoded frames held in memory.",
+                       lambda: frame_store.used_bytes)
+
+    def count_detection(self, future):
+        """
+        Counts a finished detection and whether it found the board; used as a done callback.
+        :param future: The future of the Detection.
+        """
+        if not future.cancelled() and future.exception() is None:
+            self.detections.inc()
+            if future.result().found:
+                self.boards_found.inc()
+
+class SessionLogger(logging.LoggerAdapter):
+    """
+    Logger adapter tagging every message with the session id.
+    """
+
+    def process(self, msg, kwargs):
+        return f"[session {self.extra['session_id']}] {msg}", kwargs
+
+class CalibrationSession:
+    """
+    State of the calibration of one connected camera rig: its image counts, its frames in the
+    frame store, its result directory and its pending corner detections.
+
+    A client that sends EnableFeedback gets the detection result of every frame as soon as it is
+    known, and the session then counts only informative views: views where every camera found
+    the board and that fall in a coverage bin that is not full yet.
+
+    A client that sends EnableFlowControl gets one Ack, Busy or Rejected reply per frame and keeps
+    a bounded number of frames in flight. Without it, a session whose detection backlog is full
+    stops reading until a detection finishes, and TCP holds the client back.
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, connection, client_address, detection_executor, job_runner, frame_store, cache, rectifier,
+                 metrics, store):
+        """
+        :param connection: The non-blocking socket connection of the client.
+        :param client_address: The (host, port) address of the client.
+        :param detection_executor: The executor shared by all sessions for image decoding and corner detection.
+        :param job_runner: The CalibrationJobRunner shared by all sessions for calibration solves.
+        :param frame_store: The FrameStore shared by all sessions for the decoded frames.
+        :param cache: The CalibrationCache shared by all sessions.
+        :param rectifier: The RectificationService shared by all sessions.
+        :param metrics: The ServerMetrics shared by all sessions.
+        :param store: The CalibrationStore shared by all sessions, or None.
+        """
+        self.session_id = next(self._ids)
+        self.logger = SessionLogger(logger, {"session_id": self.session_id})
+        self.connection = connection
+        self.client_address = client_address
+        self.reader = AsyncFrameReader(connection)
+        # Session numbers start over with every server run, the directory name must not repeat across runs
+        self.directory = os.path.join(SESSION_DIRECTORY,
+                                      f"session_{time.strftime('%Y%m%d-%H%M%S')}_{uuid.uuid4().hex[:8]}")
+        self.sides = ["LEFT", "RIGHT"] if CALIBRATION_MODE == "STEREO" else ["SINGLE"]
+        self.image_counts = {side: 0 for side in self.sides}
+        self.fingerprints = {side: [] for side in self.sides}  # Fingerprints of the received frames in arrival order
+        self.detection_executor = detection_executor
+        self.pattern = PATTERN_DETECTORS[PATTERN_TYPE](PATTERN_SIZE)
+        self.square_size = SQUARE_SIZE
+        self.detector = StreamingDetector(self.pattern, scale=DETECTION_SCALE, executor=detection_executor,
+                                          detection_time=metrics.detection_time)
+        self.job_runner = job_runner
+        self.frame_store = frame_store
+        self.cache = cache
+        self.rectifier = rectifier
+        self.metrics = metrics
+        self.store = store
+        self.rig = client_address[0]   # The rig the results are stored for until the client names it
+        self.rectified_pairs = None     # Rectifications in request order, created with the first request
+        self._rectification_sender = None
+        self.feedback = False
+        self.flow_control_window = None     # The granted window once the client enabled flow control
+        self.paused = False         # Images are turned away since one was, until the client resumes
+        self.frame_numbers = {}     # Camera side -> number of frames received over the connection
+        self.detection_slots = asyncio.Semaphore(MAX_PENDING_DETECTIONS)
+        self.calibration_lock = asyncio.Lock()  # Solves of one session run in order, they share its directory
+        self.calibrations = set()   # Running calibrations of completed image sets
+        self.evaluations = set()    # Running evaluations of the frames of a feedback client
+        self.calibration_encoding = "JSON"
+        self.coverage = CoverageMap(self.pattern.pattern_size, MAX_VIEWS_PER_BIN)
+        self.accepted_views = []    # (view number, [(Detection, fingerprint) of every camera]) of each accepted view
+        self.pending_views = {}     # View number -> {camera side: (Detection, fingerprint)} until all cameras are in
+        self._send_lock = asyncio.Lock()
+        self._loop = asyncio.get_running_loop()
+
+    async def send_client_message(self, message):
+        """
+        Sends a message to the client. Messages from concurrent tasks are never interleaved.
+        :param message: The message to send, as text or bytes.
+        """
+        if isinstance(message, str):
+            message = message.encode()
+        async with self._send_lock:
+            await self._loop.sock_sendall(self.connection, message)
+
+    async def notify_client(self, message):
+        """
+        Sends a message that nothing on the server waits for. A client that left is only logged,
+        so background work such as a calibration goes on without it.
+        :param message: The message to send, as text or bytes.
+        """
         try:
-            chunk = connection.recv(1)
-            if not chunk:
-                print("Connection closed by client.")
+            await self.send_client_message(message)
+        except OSError as e:
+            self.logger.debug("Client unreachable, message not sent: %s", e)
+
+    async def receive_header(self):
+        """
+        Receives the header data from the connection.
+        :return: The header data as a string, or None if there's an issue.
+        """
+        try:
+            header_data = await self.reader.read_line()
+            if header_data is None:
+                self.logger.info("Connection closed by client.")
                 return None
-            header_data += chunk
-        except socket.timeout:
-            print("Timeout while receiving the header.")
-            return None
         except Exception as e:
-            print(f"Error receiving header: {e}")
+            self.logger.warning("Error receiving header: %s", e)
             return None
-    return header_data.decode('utf-8').strip()
+        return header_data.decode('utf-8').strip()
 
-def receive_image(connection, length):
-    """
-    Receives the image data based on the specified length.
-    :param connection: The socket connection from the client.
-    :param length: The length of the image data to receive.
-    :return: The image data as bytes.
-    """
-    buffer = b''
-    while len(buffer) < length:
+    async def process_image_data(self, header):
+        """
+        Processes the received image data.
+        :param header: The header information containing image data details.
+        :return: False if the connection broke while receiving the image, True otherwise.
+        """
         try:
-            to_read = length - len(buffer)
-            data = connection.recv(4096 if to_read > 4096 else to_read)
-            if not data:
-                print("No more data received.")
-                break
-            buffer += data
-        except socket.timeout:
-            print("Socket timeout during image reception.")
-            continue
+            camera_side, length, payload_format, size = parse_image_header(header)
+        except (ValueError, IndexError) as e:
+            self.logger.warning("Error parsing header or length: %s | Error: %s", header, e)
+            if self.flow_control_window is None:
+                return True
+            # Without a length the payload cannot be skipped, the next header is not found reliably
+            await self.send_client_message("Rejected:HEADER\n")
+            return False
+        start = time.perf_counter()
+        try:
+            image_data = await self.reader.read_exact(length)
+        except Exception as e:
+            self.logger.warning("Error receiving image data: %s", e)
+            return False
+        if len(image_data) != length:
+            self.logger.warning("Received incomplete %s image data.", camera_side)
+            return False
+        self.metrics.frame_receive_time.observe(time.perf_counter() - start)
+        self.metrics.frame_bytes.observe(length)
+        number = self.frame_numbers[camera_side] = self.frame_numbers.get(camera_side, 0) + 1
+        reply = await self.save_image(image_data, camera_side, payload_format, size)
+        if self.flow_control_window is not None:
+            reply, _, reason = reply.partition(":")
+            await self.send_client_message(f"{reply}:{camera_side}:{number}{':' if reason else ''}{reason}\n")
+        return True
+
+    async def save_image(self, image_data, prefix, payload_format="PNG", size=None):
+        """
+        Decodes the received image into the frame store and queues its corner detection. Once every
+        camera side holds REQUIRED_IMAGE_COUNT images, the set is calibrated in the background while
+        the following images already count towards the next set. An image that cannot be decoded or
+        stored still counts, as a view without the target, so the following images pair up as sent.
+        :param image_data: The image payload.
+        :param prefix: The prefix indicating the camera side (LEFT, RIGHT or SINGLE).
+        :param payload_format: The payload format, one of PAYLOAD_FORMATS.
+        :param size: The frame size as (width, height) for the GRAY8 formats.
+        :return: The outcome for the flow control reply: Ack, Busy:<reason> if the image should be sent
+                 again later, or Rejected:<reason> if it will never be accepted.
+        """
+        if prefix not in self.image_counts:
+            self.logger.warning("Ignoring image for unknown camera side: %s", prefix)
+            return "Rejected:UNKNOWN_SIDE"
+        if self.flow_control_window is not None and self.paused:
+            return self.turn_away("DETECTION_BACKLOG")
+        # The fingerprint only depends on the payload, so a frame detected before, e.g. sent again after
+        # a reconnect, is neither decoded nor stored and takes no detection slot
+        fingerprint = frame_fingerprint(image_data, payload_format, size)
+        cached = self.cache.detection(detection_key(fingerprint, self.pattern, DETECTION_SCALE))
+        if cached is not None:
+            self.metrics.detection_cache_hits.inc()
+            if ARCHIVE_FRAMES:
+                self.archive_image(functools.partial(write_payload, payload_format=payload_format, size=size),
+                                   image_data, prefix, self.image_counts[prefix] + 1)
+            detection = self.detector.add_result(prefix, cached)
+            detection.add_done_callback(self.metrics.count_detection)
+            self.add_frame(prefix, detection, fingerprint)
+            return "Ack"
+
+        if self.flow_control_window is not None and self.detection_slots.locked():
+            return self.turn_away("DETECTION_BACKLOG")
+        # Every queued detection holds a slot, so a fast client cannot queue frames without bound
+        await self.detection_slots.acquire()
+        if payload_format == "GRAY8":
+            # Raw frames are only wrapped, which is cheaper than a round trip through the executor
+            frame = timed_call(self.metrics.decode_time, decode_image, image_data, payload_format, size)
+        else:
+            frame = await self._loop.run_in_executor(self.detection_executor, timed_call, self.metrics.decode_time,
+                                                     decode_image, image_data, payload_format, size)
+        if frame is None:
+            self.detection_slots.release()
+            self.logger.warning("Failed to decode received %s image.", prefix)
+            self.add_frame(prefix, None, fingerprint, "INVALID")
+            return "Rejected:INVALID"
+        frame_key = self.frame_store.add(self.session_id, frame)
+        if frame_key is None:
+            self.detection_slots.release()
+            if self.flow_control_window is not None:
+                self.logger.warning("Frame memory budget exhausted, turning away %s image.", prefix)
+                return self.turn_away("MEMORY")
+            # The client does not learn about it and cannot send the image again
+            self.logger.warning("Frame memory budget exhausted, dropping %s image.", prefix)
+            self.add_frame(prefix, None, DROPPED_FRAME, "DROPPED")
+            return "Ack"
+
+        self.logger.debug("%s image %d stored.", prefix, self.image_counts[prefix] + 1)
+        if ARCHIVE_FRAMES:
+            # PNG payloads are archived as received, raw frames are encoded to PNG by the archival thread
+            if payload_format == "PNG":
+                self.archive_image(write_file, image_data, prefix, self.image_counts[prefix] + 1)
+            else:
+                self.archive_image(write_frame, frame, prefix, self.image_counts[prefix] + 1)
+        detection = self.detect(prefix, frame, fingerprint, frame_key)
+        self.add_frame(prefix, detection, fingerprint)
+        return "Ack"
+
+    def add_frame(self, prefix, detection, fingerprint, failure=None):
+        """
+        Counts a frame towards the current set of its camera side and starts the set's calibration once
+        every side is complete. In feedback mode the frame is evaluated as part of its view instead.
+        :param prefix: The camera side (LEFT, RIGHT or SINGLE).
+        :param detection: The future of the frame's Detection, None for a frame without a detection.
+        :param fingerprint: The frame's content fingerprint.
+        :param failure: Why the frame has no detection: INVALID if it could not be decoded, DROPPED if the frame
+                        memory budget was used up. It still takes its view number, so that the following frames
+                        pair up correctly.
+        """
+        self.image_counts[prefix] += 1
+        if self.feedback:
+            self.start_evaluation(prefix, self.image_counts[prefix], detection, fingerprint, failure)
+            return
+        if detection is None:
+            self.detector.add_result(prefix, Detection(False, None, None))
+        self.fingerprints[prefix].append(fingerprint)
+        if all(count >= REQUIRED_IMAGE_COUNT for count in self.image_counts.values()):
+            self.complete_image_set()
+
+    def detect(self, prefix, frame, fingerprint, frame_key):
+        """
+        Queues the corner detection of a frame and caches its Detection once done.
+        The frame is released from the frame store as soon as its detection is done.
+        :param prefix: The camera side (LEFT, RIGHT or SINGLE).
+        :param frame: The decoded grayscale frame.
+        :param fingerprint: The frame's content fingerprint.
+        :param frame_key: The frame's key in the frame store.
+        :return: The future of the frame's Detection.
+        """
+        detection = self.detector.submit(prefix, frame, self.pattern)
+        detection.add_done_callback(functools.partial(self._detection_done, frame_key))
+        self.cache.store_detection(detection_key(fingerprint, self.pattern, DETECTION_SCALE), detection)
+        detection.add_done_callback(self.metrics.count_detection)
+        return detection
+
+    def turn_away(self, reason):
+        """
+        Turns an image of a flow-controlled client away with a Busy reply. Images are paired by their order,
+        so every following image is turned away as well until the client sends Resume and then sends the
+        images again in order.
+        :param reason: Why the image could not be taken: DETECTION_BACKLOG or MEMORY.
+        :return: The outcome for the flow control reply.
+        """
+        self.metrics.busy_frames.inc()
+        if self.paused:
+            return "Busy:PAUSED"
+        self.paused = True
+        return f"Busy:{reason}"
+
+    async def resume(self):
+        """
+        Takes images again after they were turned away, once a detection slot is free, and tells the client.
+        """
+        async with self.detection_slots:
+            pass
+        self.paused = False
+        await self.send_client_message("Resumed\n")
+
+    def _detection_done(self, frame_key, future):
+        """
+        Releases the frame of a finished or cancelled detection and then frees its detection slot, so the
+        next frame finds the memory returned to the budget; called on the detection thread.
+        """
+        self.frame_store.release(self.session_id, frame_key)
+        self._loop.call_soon_threadsafe(self.detection_slots.release)
+
+    def complete_image_set(self):
+        """
+        Starts the calibration of the first REQUIRED_IMAGE_COUNT images of every camera side in the
+        background. Images beyond them, e.g. of a camera side that ran ahead, start the next set.
+        """
+        futures = self.detector.take(REQUIRED_IMAGE_COUNT)
+        fingerprints = []
+        for side in self.sides:
+            fingerprints.append(self.fingerprints[side][:REQUIRED_IMAGE_COUNT])
+            del self.fingerprints[side][:REQUIRED_IMAGE_COUNT]
+            self.image_counts[side] -= REQUIRED_IMAGE_COUNT
+        self.logger.info("Image set complete, preparing for a new set of images.")
+        # The client may select another target for the next set while this one is still detected and solved
+        self.start_calibration(self.calibrate_image_set([futures[side] for side in self.sides], fingerprints,
+                                                        self.pattern, self.square_size))
+
+    def start_calibration(self, calibration):
+        """
+        Runs the calibration of a completed set in the background. The session keeps a reference to it,
+        so the calibration runs to its end and the session waits for it before closing.
+        :param calibration: The calibration coroutine.
+        """
+        task = asyncio.create_task(calibration)
+        self.calibrations.add(task)
+        task.add_done_callback(functools.partial(self._task_done, self.calibrations))
+
+    async def calibrate_image_set(self, futures, fingerprints, pattern, square_size):
+        """
+        Waits for the detections of a complete image set and calibrates from them.
+        :param futures: The detection futures of every camera side, in the order of self.sides.
+        :param fingerprints: The frame fingerprints of every camera side, in the same order.
+        :param pattern: The PatternDetector of the set's target.
+        :param square_size: The size of the unit of the set's target.
+        """
+        try:
+            detections = [await asyncio.gather(*(asyncio.wrap_future(future) for future in side))
+                          for side in futures]
         except Exception as e:
-            print(f"Error receiving image data: {e}")
-            break
-    return buffer
-
-def send_client_message(connection, message):
-    """
-    Sends a message to the client.
-    :param connection: The socket connection to the client.
-    :param message: The message to send.
-    """
-    connection.sendall(message.encode())
-
-def save_image(image_data, prefix):
-    """
-    Saves the received image data to a file.
-    :param image_data: The image data to save.
-    :param prefix: The prefix indicating the camera side (LEFT or RIGHT).
-    """
-    global image_counts
-    directory = prefix if CALIBRATION_MODE == "STEREO" else "SINGLE"
-    
-    if reception_event.is_set() and image_counts[prefix] < REQUIRED_IMAGE_COUNT:
-        image_counts[prefix] += 1
-        filename = f"{directory}/{directory}_{image_counts[prefix]}.png"
-        with open(filename, "wb") as image_file:
-            image_file.write(image_data)
-        print(f"{directory} image {image_counts[prefix]} saved.")
-    
-        if (CALIBRATION_MODE == "STEREO" and all(count >= REQUIRED_IMAGE_COUNT for count in image_counts.values())) or \
-           (CALIBRATION_MODE == "SINGLE" and image_counts["SINGLE"] >= REQUIRED_IMAGE_COUNT):
-            send_client_message(connection, "Calibrating...")
-            reception_event.clear()
-            trigger_calibration()
-            reset_image_counts()
-
-def process_image_data(connection, header):
-    """
-    Processes the received image data.
-    :param connection: The socket connection from the client.
-    :param header: The header information containing image data details.
-    """
-    if reception_event.is_set():
+            self.metrics.calibration_failures.inc()
+            self.logger.error("Detection failed, the image set cannot be calibrated: %r", e)
+            await self.notify_client("CalibrationFailed")
+            return
+        async with self.calibration_lock:
+            await self.calibrate(detections, fingerprints, list(range(1, REQUIRED_IMAGE_COUNT + 1)), pattern,
+                                 square_size)
+
+    async def calibrate_views(self, views, pattern, square_size):
+        """
+        Calibrates from a complete set of views accepted in feedback mode.
+        :param views: The (view number, [(Detection, fingerprint) of every camera]) of each accepted view.
+        :param pattern: The PatternDetector of the set's target.
+        :param square_size: The size of the unit of the set's target.
+        """
+        cameras = range(len(self.sides))
+        async with self.calibration_lock:
+            await self.calibrate([[view[camera][0] for _, view in views] for camera in cameras],
+                                 [[view[camera][1] for _, view in views] for camera in cameras],
+                                 [number for number, _ in views], pattern, square_size)
+
+    def start_evaluation(self, prefix, index, detection, fingerprint, failure=None):
+        """
+        Evaluates a frame of a feedback client in the background, see evaluate_frame. The session keeps
+        a reference to it and waits for it before closing.
+        """
+        task = asyncio.create_task(self.evaluate_frame(prefix, index, detection, fingerprint, failure))
+        self.evaluations.add(task)
+        task.add_done_callback(functools.partial(self._task_done, self.evaluations))
+
+    def _task_done(self, tasks, task):
+        """
+        Stops tracking a finished background task of the session and reports its failure.
+        :param tasks: The set of tasks it was tracked in.
+        :param task: The finished task.
+        """
+        tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            self.logger.error("Background task of the session failed: %r", task.exception())
+
+    async def evaluate_frame(self, prefix, index, detection, fingerprint, failure=None):
+        """
+        Reports the detection result of a frame to the client and, once the frames of all cameras
+        for this view are in, decides whether the view is kept.
+        :param prefix: The camera side (LEFT, RIGHT or SINGLE).
+        :param index: The number of the frame within its camera side, which is also its view number.
+                      Views keep their numbers across image sets, so frames are never paired across views.
+        :param detection: The future of the frame's Detection, None if the frame has none.
+        :param fingerprint: The frame's content fingerprint.
+        :param failure: Why the frame has no detection, see add_frame.
+        """
+        if detection is None:
+            result = Detection(False, None, None)
+            messages = [f"FrameResult:{prefix}:{index}:{failure}\n"]
+        else:
+            result = await asyncio.wrap_future(detection)
+            messages = [f"FrameResult:{prefix}:{index}:{'FOUND' if result.found else 'NO_BOARD'}\n"]
+
+        # Update the view state before awaiting anything, so concurrent evaluations see a consistent state
+        completed_views = None
+        view = self.pending_views.setdefault(index, {})
+        view[prefix] = (result, fingerprint)
+        if len(view) == len(self.sides):
+            del self.pending_views[index]
+            detections = [view[side][0] for side in self.sides]
+            if not all(detection.found for detection in detections):
+                messages.append(f"ViewResult:{index}:REJECTED:NO_BOARD\n")
+            elif self.coverage.is_redundant(detections):
+                messages.append(f"ViewResult:{index}:REJECTED:REDUNDANT\n")
+            else:
+                self.coverage.add(detections)
+                self.accepted_views.append((index, [view[side] for side in self.sides]))
+                messages.append(f"ViewResult:{index}:ACCEPTED:{len(self.accepted_views)}/{REQUIRED_IMAGE_COUNT}\n")
+                if len(self.accepted_views) >= REQUIRED_IMAGE_COUNT:
+                    # Views arriving while this set is solved already count towards the next one
+                    completed_views = self.accepted_views
+                    self.start_next_view_set()
+
+        await self.notify_client("".join(messages))
+        if completed_views:
+            self.start_calibration(self.calibrate_views(completed_views, self.pattern, self.square_size))
+
+    def archive_image(self, writer, data, prefix, index):
+        """
+        Writes a received image to the session directory in the background, off the critical path.
+        :param writer: write_file for encoded image data or write_frame for a decoded frame.
+        :param data: The encoded image data or the decoded frame.
+        :param prefix: The camera side (LEFT, RIGHT or SINGLE).
+        :param index: The number of the image within its camera side.
+        """
+        filename = os.path.join(self.directory, prefix, f"{prefix}_{index}.png")
+        archival = self._loop.run_in_executor(None, timed_call, self.metrics.archive_time, writer, filename, data)
+        archival.add_done_callback(functools.partial(self._archive_done, filename))
+
+    def _archive_done(self, filename, future):
+        """
+        Reports a failed background archival.
+        """
+        if not future.cancelled() and future.exception():
+            self.logger.error("Failed to archive %s: %s", filename, future.exception())
+
+    async def calibrate(self, detections, fingerprints, view_numbers, pattern, square_size):
+        """
+        Submits the calibration to the job runner, stores the result and then reports it to the client.
+        The corners were already detected while the images arrived, so only the solve is left,
+        and an image set that was calibrated before reuses the cached result instead. The solve
+        and the store do not depend on the client, a set is still calibrated when the client left.
+        :param detections: The Detection list of every camera side, in the order of self.sides.
+        :param fingerprints: The frame fingerprints of every camera side, in the order of detections.
+        :param view_numbers: The number of each view as the client knows it, in the order of detections.
+        :param pattern: The PatternDetector the detections were made with.
+        :param square_size: The size of the target's unit.
+        """
+        await self.notify_client("Calibrating...")
+        key = result_key(fingerprints, CALIBRATION_MODE, square_size, pattern, DETECTION_SCALE, MAX_VIEW_ERROR)
         try:
-            prefix, length_str = header.split("ImageData:")
-            length = int(length_str)
-            camera_side = prefix.replace("Sending", "")
-            image_data = receive_image(connection, length)
-            if image_data and len(image_data) == length:
-                save_image(image_data, camera_side)
+            # Without archival nothing else creates the session directory
+            os.makedirs(self.directory, exist_ok=True)
+            files = self.cache.result(key)
+            if files is not None:
+                self.metrics.result_cache_hits.inc()
+                self.logger.info("Reusing the cached calibration of an identical image set.")
+                await self._loop.run_in_executor(None, write_result_files, self.directory, files)
+                if CALIBRATION_MODE == "STEREO":
+                    # The rectification maps are too large to cache, they are computed again from the result
+                    await asyncio.wrap_future(self.job_runner.submit_rectification(self.directory))
             else:
-                print(f"Received incomplete {camera_side} image data.")
-        except ValueError as e:
-            print(f"Error parsing header or length: {header} | Error: {e}")
+                start = time.perf_counter()
+                rms_error = await self.solve(detections, pattern, square_size)
+                solve_time = time.perf_counter() - start
+                self.metrics.solve_time.observe(solve_time)
+                self.metrics.rms_error.observe(rms_error)
+                self.logger.info("Solved in %.2f s, RMS error %.4f px.", solve_time, rms_error)
+                files = await self._loop.run_in_executor(None, read_result_files, self.directory)
+                self.cache.store_result(key, files)
+            if CALIBRATION_MODE == "STEREO":
+                await self._loop.run_in_executor(None, self.rectifier.publish_calibration, self.rig, self.directory)
+        except Exception as e:
+            self.metrics.calibration_failures.inc()
+            self.logger.error("Calibration failed: %s", e)
+            await self.notify_client("CalibrationFailed")
+            return
+        self.metrics.calibrations.inc()
+        self.logger.info("Calibration Complete")
+        await self.store_calibration(files)
+        try:
+            await self.send_client_message("Calibrated!")
+            if CALIBRATION_MODE == "STEREO":
+                await self.send_calibration_data()
+            await self.send_view_errors(view_numbers)
+        except OSError as e:
+            self.logger.warning("Sending the calibration result to the client failed: %s", e)
+
+    async def solve(self, detections, pattern, square_size):
+        """
+        Runs the calibration solve on the job runner, saving the results to the session directory.
+        :param detections: The Detection list of every camera side, in the order of self.sides.
+        :param pattern: The PatternDetector the detections were made with.
+        :param square_size: The size of the target's unit.
+        :return: The RMS re-projection error of the calibration.
+        """
+        self.logger.info("Triggering %s camera calibration...", CALIBRATION_MODE.lower())
+        if CALIBRATION_MODE == "SINGLE":
+            job = self.job_runner.submit_single(detections[0], square_size, pattern, "SINGLE", self.directory,
+                                                MAX_VIEW_ERROR)
+        else:
+            job = self.job_runner.submit_stereo(detections[0], detections[1], square_size, pattern, self.directory,
+                                                MAX_VIEW_ERROR)
+        result = await asyncio.wrap_future(job)
+        return result.rms_error if CALIBRATION_MODE == "SINGLE" else result
+
+    async def store_calibration(self, files):
+        """
+        Adds a calibration to the versioned store under the session's rig. A failure is only logged,
+        the session directory still holds the results.
+        :param files: The saved calibration files as {filename: bytes}.
+        """
+        if self.store is None:
+            return
+        try:
+            await self._loop.run_in_executor(None, self.store.save, self.rig, files)
+        except Exception as e:
+            self.logger.error("Storing the calibration of rig %s failed: %s", self.rig, e)
 
-def trigger_calibration():
+    async def select_rig(self, header):
+        """
+        Names the rig the session's calibrations are stored for, from a SetRig header.
+        :param header: The SetRig header.
+        """
+        rig = header.split(":", 1)[1]
+        if not RIG_ID_PATTERN.fullmatch(rig):
+            await self.send_client_message("RigRejected:INVALID\n")
+            return
+        self.rig = rig
+        self.logger.info("Storing calibrations for rig %s.", rig)
+        await self.send_client_message(f"Rig:{rig}\n")
+
+    async def send_stored_calibration(self, header):
+        """
+        Sends the latest stored stereo calibration of a rig, the session's rig by default, from a
+        GetCalibration header, in the encoding the client selected.
+        :param header: The GetCalibration header.
+        """
+        rig = header.split(":", 1)[1] if ":" in header else self.rig
+        if self.store is None:
+            await self.send_client_message(f"CalibrationNotFound:{rig}\n")
+            return
+        record, payload = await self._loop.run_in_executor(None, latest_calibration_payload, self.store, rig,
+                                                           self.calibration_encoding)
+        if record is None:
+            await self.send_client_message(f"CalibrationNotFound:{rig}\n")
+            return
+        await self.send_client_message(f"Calibration:{record.created:.3f}:{rig}\n".encode() + payload)
+
+    async def send_calibration_data(self):
+        """
+        Sends the stereo calibration data to the Unity client in the encoding it selected.
+        The loader caches the encoded data, so the file is only parsed once per result.
+        """
+        self.logger.debug("Loading and sending calibration data to client...")
+        payload = await self._loop.run_in_executor(None, stereo_calibration_payload,
+                                                   os.path.join(self.directory, 'stereo_calibration_data.npz'),
+                                                   self.calibration_encoding)
+        await self.send_client_message(payload)
+        self.logger.debug("Calibration data sent to the client.")
+
+    async def send_view_errors(self, view_numbers):
+        """
+        Sends the RMS reprojection error of every calibrated view and the views rejected as outliers,
+        per camera side, so the client can see which views to retake.
+        :param view_numbers: The number of each view as the client knows it, in calibration order.
+        """
+        messages = []
+        for side in self.sides:
+            filename = os.path.join(self.directory, f"{side.lower()}_calibration_data.npz")
+            errors = await self._loop.run_in_executor(None, load_view_errors, filename)
+            if errors is None:
+                continue
+            view_indices, view_errors, rejected_views = errors
+            numbers = [view_numbers[index] for index in view_indices]
+            messages.append(f"ViewErrors:{side}:" + ",".join(f"{number}={error:.4f}"
+                                                             for number, error in zip(numbers, view_errors)) + "\n")
+            messages.append(f"RejectedViews:{side}:" + ",".join(str(number)
+                                                                for number, rejected in zip(numbers, rejected_views)
+                                                                if rejected) + "\n")
+        await self.send_client_message("".join(messages))
+
+    def start_next_view_set(self):
+        """
+        Starts collecting a new set of views in feedback mode. Views still being evaluated
+        continue with their numbers and count towards the new set.
+        """
+        self.logger.info("Starting a new set of views.")
+        self.accepted_views = []
+        self.coverage.reset()
+        self.detector.reset(cancel=False)
+
+    async def run(self):
+        """
+        Receives images from the client until the connection is closed.
+        """
+        while True:
+            header = await self.receive_header()
+            if not header:
+                self.logger.info("Header reception was incomplete or failed. Closing connection...")
+                break
+            if header == "Status":
+                status = self.metrics.registry.render().encode()
+                await self.send_client_message(f"Status:{len(status)}\n".encode() + status)
+                continue
+            if header == "ListFormats":
+                await self.send_client_message(f"Formats:{','.join(PAYLOAD_FORMATS)}\n")
+                continue
+            if header.startswith("SetCalibrationEncoding:"):
+                encoding = header.split(":", 1)[1]
+                if encoding in CALIBRATION_ENCODINGS:
+                    self.calibration_encoding = encoding
+                await self.send_client_message(f"CalibrationEncoding:{self.calibration_encoding}\n")
+                continue
+            if header.startswith("SetPattern:"):
+                await self.select_pattern(header)
+                continue
+            if header.startswith("SetRig:"):
+                await self.select_rig(header)
+                continue
+            if header == "GetCalibration" or header.startswith("GetCalibration:"):
+                await self.send_stored_calibration(header)
+                continue
+            if header == "EnableFlowControl" or header.startswith("EnableFlowControl:"):
+                self.enable_flow_control(header)
+                await self.send_client_message(f"FlowControl:{self.flow_control_window}\n")
+                continue
+            if header == "Resume":
+                await self.resume()
+                continue
+            if header == "EnableFeedback":
+                self.feedback = True
+                await self.send_client_message("FeedbackEnabled\n")
+                continue
+            if header.startswith("RectifyPair:"):
+                if not await self.process_rectify_request(header):
+                    break
+                continue
+            if not await self.process_image_data(header):
+                break
+
+    def enable_flow_control(self, header):
+        """
+        Turns on the per-frame replies with the window of an EnableFlowControl header, at most FLOW_CONTROL_WINDOW.
+        :param header: The EnableFlowControl header, optionally with the window the client asks for.
+        """
+        try:
+            window = int(header.split(":", 1)[1]) if ":" in header else FLOW_CONTROL_WINDOW
+        except ValueError:
+            window = FLOW_CONTROL_WINDOW
+        self.flow_control_window = min(max(window, 1), FLOW_CONTROL_WINDOW)
+        self.logger.info("Flow control enabled with a window of %d frames.", self.flow_control_window)
+
+    async def select_pattern(self, header):
+        """
+        Switches the session to the calibration target of a SetPattern header. The target can only
+        change before the first image of a set, since the images of one set must show the same target.
+        Sets that are still detected or solved keep the target they were sent with.
+        :param header: The SetPattern header.
+        """
+        if self.feedback:
+            # The frame counts are view numbers in feedback mode, they carry on across sets
+            set_started = bool(self.accepted_views or self.pending_views or self.evaluations)
+        else:
+            set_started = any(self.image_counts.values())
+        if set_started:
+            await self.send_client_message("PatternRejected:IMAGES_RECEIVED\n")
+            return
+        try:
+            self.pattern, self.square_size = parse_pattern_header(header)
+        except (ValueError, IndexError, TypeError) as e:
+            self.logger.warning("Error parsing pattern header: %s | Error: %s", header, e)
+            await self.send_client_message("PatternRejected:INVALID\n")
+            return
+        self.coverage = CoverageMap(self.pattern.pattern_size, MAX_VIEWS_PER_BIN)
+        width, height = self.pattern.pattern_size
+        self.logger.info("Calibrating with a %dx%d %s target.", width, height, self.pattern.name)
+        await self.send_client_message(f"Pattern:{self.pattern.name}:{width}x{height}:{self.square_size}\n")
+
+    async def process_rectify_request(self, header):
+        """
+        Receives a stereo pair and queues its rectification. Up to RECTIFICATION_PIPELINE_DEPTH pairs are
+        rectified while the next ones are received, and the results are sent back in request order.
+        :param header: The RectifyPair header.
+        :return: False if the connection broke while receiving the pair or the header cannot be parsed,
+                 True otherwise.
+        """
+        try:
+            left_length, right_length, payload_format, size = parse_rectify_header(header)
+        except (ValueError, IndexError) as e:
+            self.logger.warning("Error parsing rectification header: %s | Error: %s", header, e)
+            rejection = Future()
+            rejection.set_exception(RectificationError("HEADER"))
+            await self.queue_rectification(rejection, None)
+            # Without the payload lengths the next header cannot be found; the rejection is sent in request
+            # order after the pairs before it, then the connection is closed
+            drained = asyncio.ensure_future(self.rectified_pairs.join())
+            await asyncio.wait((drained, self._rectification_sender), return_when=asyncio.FIRST_COMPLETED)
+            drained.cancel()
+            return False
+        try:
+            left_data = await self.reader.read_exact(left_length)
+            right_data = await self.reader.read_exact(right_length)
+        except Exception as e:
+            self.logger.warning("Error receiving stereo pair: %s", e)
+            return False
+        if len(left_data) != left_length or len(right_data) != right_length:
+            self.logger.warning("Received incomplete stereo pair.")
+            return False
+
+        try:
+            rectification = self.rectifier.submit(self.rig, left_data, right_data, payload_format, size)
+        except RectificationError as e:
+            rectification = Future()
+            rectification.set_exception(e)
+        await self.queue_rectification(rectification, payload_format)
+        return True
+
+    async def queue_rectification(self, rectification, payload_format):
+        """
+        Queues the reply to a rectification request, starting the sender of the replies on the first one.
+        Waits while the pipeline is full, so a fast client cannot queue unbounded work.
+        :param rectification: The future of the rectify_pair result.
+        :param payload_format: The payload format of the pair.
+        """
+        if self.rectified_pairs is None:
+            self.rectified_pairs = asyncio.Queue(RECTIFICATION_PIPELINE_DEPTH)
+            self._rectification_sender = asyncio.create_task(self.send_rectified_pairs())
+        await self.rectified_pairs.put((rectification, payload_format))
+
+    async def send_rectified_pairs(self):
+        """
+        Sends the rectified pairs back to the client in request order, as they complete.
+        """
+        while True:
+            rectification, payload_format = await self.rectified_pairs.get()
+            try:
+                await self.send_rectified_pair(rectification, payload_format)
+            finally:
+                self.rectified_pairs.task_done()
+
+    async def send_rectified_pair(self, rectification, payload_format):
+        """
+        Sends one rectified pair, or the reason it could not be rectified, once its rectification completed.
+        :param rectification: The future of the rectify_pair result.
+        :param payload_format: The payload format of the pair.
+        """
+        try:
+            left, right, (width, height) = await asyncio.wrap_future(rectification)
+        except RectificationError as e:
+            await self.send_client_message(f"RectifyFailed:{e}\n")
+            return
+        except Exception as e:
+            self.logger.error("Rectification failed: %s", e)
+            await self.send_client_message("RectifyFailed:ERROR\n")
+            return
+        header = f"RectifiedPair:{len(left)}:{len(right)}:{payload_format}:{width}x{height}\n".encode()
+        await self.send_client_message(b"".join((header, left, right)))
+
+    def close(self):
+        """
+        Drops the pending detections, rectifications and stored frames and closes the connection.
+        """
+        if self._rectification_sender is not None:
+            self._rectification_sender.cancel()
+        self.detector.shutdown()
+        self.frame_store.release(self.session_id)
+        self.connection.close()
+
+async def handle_client(connection, client_address, detection_executor, job_runner, frame_store, cache, rectifier,
+                        metrics, store):
     """
-    Triggers the appropriate calibration process based on the CALIBRATION_MODE.
+    Serves one client connection with its own calibration session.
     """
-    if CALIBRATION_MODE == "SINGLE":
-        print("Triggering single camera calibration...")
-        subprocess.run(["python", "SingleCameraCalibration.py"])
-    elif CALIBRATION_MODE == "STEREO":
-        print("Triggering stereo camera calibration...")
-        subprocess.run(["python", "StereoCalibration.py"])
-        # send_calibration_data()
-    else:
-        print(f"Unknown CALIBRATION_MODE: {CALIBRATION_MODE}")
-
-def send_calibration_data(connection):
-    """
-    Loads and sends the stereo calibration data to the Unity client.
-    :param connection: The socket connection to the client.
-    """
-    print("Loading and sending calibration data to client...")
-    calibration_data = load_stereo_calibration_results('stereo_calibration_data.npz')
-    calibration_json = json.dumps(calibration_data)
-    # Mark the start and end of the calibration data transmission
-    start_marker = "CalibrationDataStart"
-    end_marker = "CalibrationDataEnd"
-    send_client_message(connection, f"{start_marker}\n{calibration_json}\n{end_marker}")
-    print("Calibration data sent to the client.")
-
-def reset_image_counts():
-    """
-    Resets the image count for a new calibration process.
-    """
-    global image_counts
-    print("Resetting image counts and preparing for a new set of images.")
-    for key in image_counts.keys():
-        image_counts[key] = 0
-
-def listen_for_calibration_complete():
-    """
-    Listens for the calibration completion signal.
-    """
-    while True:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server_signal_socket:
-            server_signal_socket.bind((HOST, SIGNAL_PORT))
-            server_signal_socket.listen()
-            conn, _ = server_signal_socket.accept()
-            with conn:
-                while True:
-                    data = conn.recv(1024)
-                    if data:
-                        print(data.decode())
-                        send_client_message(connection, "Calibrated!")
-                        send_calibration_data(connection)
-                        reception_event.set()
-                        break
-
-# Initialize the server and image count
-reception_event = threading.Event()
-reception_event.set()
-image_counts = {"LEFT": 0, "RIGHT": 0}
-threading.Thread(target=listen_for_calibration_complete, daemon=True).start()
-
-# Main server loop
-server_socket = create_server_socket(HOST, PORT, TIMEOUT)
-while True:
+    session = CalibrationSession(connection, client_address, detection_executor, job_runner, frame_store, cache,
+                                 rectifier, metrics, store)
+    session.logger.info("Connected with %s:%d, results in %s", client_address[0], client_address[1],
+                        session.directory)
     try:
-        connection, client_address = server_socket.accept()
-        print('Connected with ' + client_address[0] + ':' + str(client_address[1]))
-        connection.settimeout(RECEPTION_TIMEOUT)
-    except socket.timeout:
-        print("Server socket timeout. Awaiting new connection...")
-        continue
-    except KeyboardInterrupt:
-        print("Keyboard interrupt received. Closing server.")
-        break
+        await session.run()
     except Exception as e:
-        print(f"Error accepting connection: {e}")
-        continue
+        session.logger.error("Error during session: %s", e)
+    finally:
+        # Complete image sets are still calibrated and stored when the client left during the solve;
+        # frame evaluations may complete a set of views, so they finish first. Failures were logged by _task_done
+        for tasks in (session.evaluations, session.calibrations):
+            await asyncio.gather(*tasks, return_exceptions=True)
+        session.close()
+        session.logger.info("Connection closed.")
 
+async def serve_metrics(registry, reader, writer):
+    """
+    Answers one HTTP request on the metrics endpoint with all metrics in the Prometheus text format.
+    :param registry: The MetricsRegistry to render.
+    """
+    try:
+        # The request line and headers; every path gets the metrics
+        while (await reader.readline()).strip():
+            pass
+        body = registry.render().encode()
+        writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                     b"Content-Length: %d\r\n\r\n" % len(body) + body)
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+async def serve(job_runner):
+    """
+    Accepts client connections and runs a calibration session for each of them concurrently.
+    :param job_runner: The CalibrationJobRunner running the calibration solves.
+    """
+    loop = asyncio.get_running_loop()
+    detection_executor = ThreadPoolExecutor(max_workers=DETECTION_WORKERS, thread_name_prefix="detector")
+    frame_store = FrameStore(FRAME_MEMORY_BUDGET)
+    cache = CalibrationCache(DETECTION_CACHE_SIZE, RESULT_CACHE_SIZE)
+    rectifier = RectificationService(RECTIFICATION_DIRECTORY, RECTIFICATION_WORKERS)
+    store = CalibrationStore(CALIBRATION_STORE) if CALIBRATION_STORE is not None else None
+    rigs = rectifier.load_calibrations()
+    if rigs:
+        logger.info("Rectifying with the latest calibration of %d rigs in %s", len(rigs), RECTIFICATION_DIRECTORY)
+    sessions = set()
+    metrics = ServerMetrics(MetricsRegistry(), frame_store, sessions)
+    metrics_server = None
+    if METRICS_PORT is not None:
+        metrics_server = await asyncio.start_server(functools.partial(serve_metrics, metrics.registry),
+                                                    HOST, METRICS_PORT)
+        logger.info("Serving metrics on port %d", METRICS_PORT)
+    server_socket = create_server_socket(HOST, PORT)
     try:
         while True:
-            if not reception_event.is_set():
-                continue
+            connection, client_address = await loop.sock_accept(server_socket)
+            connection.setblocking(False)
+            task = asyncio.create_task(
+                handle_client(connection, client_address, detection_executor, job_runner, frame_store, cache,
+                              rectifier, metrics, store))
+            sessions.add(task)
+            task.add_done_callback(sessions.discard)
+    finally:
+        server_socket.close()
+        if metrics_server is not None:
+            metrics_server.close()
+        detection_executor.shutdown(wait=False, cancel_futures=True)
+        rectifier.shutdown()
+        if store is not None:
+            store.close()
 
-            ready = select.select([connection], [], [], 5.0)
-            if ready[0]:
-                header = receive_header(connection)
-                if header:
-                    process_image_data(connection, header)
-                else:
-                    print("Header reception was incomplete or failed. Closing connection...")
-                    break
-            else:
-                print("No data received. Checking again...")
+def main():
+    """
+    Runs the calibration server until it is interrupted.
+    """
+    configure_logging(LOG_LEVEL)
+    # Start the calibration workers before any threads exist, so the first session does not wait for them
+    job_runner = CalibrationJobRunner(CALIBRATION_WORKERS, LOG_LEVEL)
+    job_runner.warm_up()
+    try:
+        asyncio.run(serve(job_runner))
     except KeyboardInterrupt:
-        print("Keyboard interrupt received while connected. Closing connection.")
-    except Exception as e:
-        print(f"Error during session: {e}")
-
-    connection.close()
-    print("Connection closed. Awaiting new connection...")
+        logger.info("Keyboard interrupt received. Closing server.")
+    finally:
+        job_runner.shutdown()
+    logger.info("Server closed.")
 
-server_socket.close()
-print("Server closed.")
\ No newline at end of file
+if __name__ == "__main__":
+    main()